@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Control traces of a robot population
+
+ControlTrace keeps the squashed [acc, brake, left, right] controls of every
+robot for the last `capacity` steps in a preallocated ring buffer, together
+with the state the oldest kept step starts from. Trajectories are rebuilt from it by
+running the kinematics only (population.move), so networks are not evaluated
+again and the track is not read. Replays follow the recorded runs exactly.
+
+When the ring is full, the oldest step is folded into the start state before
+being overwritten, so the trace always holds a replayable run of the last
+`capacity` steps.
+
+Traces are saved as .npz files:
+  controls     (steps, robots, 4) squashed controls, NaN on the steps a robot was dead
+  start        (robots, 4) speed, heading, x and y before the first step
+  robot_ids    population index of each robot column
+  kinematics   acc, max_speed, turn_rate and track_scale used by the run
+  sensors      n_sensors, sensors_pitch and sensors_dist of the robots
+  version      FORMAT_VERSION of the writer
+"""
+
+import numpy as np
+
+from population import move
+
+#change it every time the meaning of the saved arrays changes. Version 1
+#traces, without a version array, hold the raw network outputs
+FORMAT_VERSION = 2
+
+
+class ControlTrace:
+    def __init__(self, n_robots, capacity=4096, dtype=np.float64):
+        self.n_robots = n_robots
+        self.capacity = capacity
+        self.controls = np.full((capacity, n_robots, 4), np.nan, dtype=dtype)
+        self.start_state = np.zeros((n_robots, 4))
+        self.kinematics = np.zeros(4)
+        self.sensors = np.zeros(3)
+        self.steps = 0
+
+    def start(self, population):
+        """Clears the trace and takes the start state of every robot from `population`"""
+        self.controls[:] = np.nan
+        self.steps = 0
+        self.start_state[:] = np.stack((population.speed, population.heading,
+                                        population.pos_x, population.pos_y), axis=1)
+        self.kinematics[:] = (population.acc, population.max_speed, population.turn_rate,
+                              population.track_scale)
+        self.sensors[:] = (population.n_sensors, population.sensors_pitch, population.sensors_dist)
+
+    def record(self, idx, controls):
+        """Stores the controls of the robots in `idx` for one step"""
+        slot = self.steps % self.capacity
+        if self.steps >= self.capacity:
+            self.start_state[:] = self.advance(self.start_state, self.controls[slot], self.kinematics)
+        self.controls[slot] = np.nan
+        self.controls[slot, idx] = controls
+        self.steps += 1
+
+    def get_controls(self):
+        """Kept controls, oldest step first"""
+        if self.steps <= self.capacity:
+            return self.controls[:self.steps]
+        slot = self.steps % self.capacity
+        return np.concatenate((self.controls[slot:], self.controls[:slot]))
+
+    @staticmethod
+    def advance(state, controls, kinematics):
+        """Moves the robots with controls one step, robots with NaN controls stay as they are"""
+        state = np.array(state)
+        stepped = ~np.isnan(controls[:, 0])
+        acc, max_speed, turn_rate, track_scale = kinematics.tolist()
+        speed, heading, pos_x, pos_y = state[stepped].T
+        state[stepped] = np.stack(move(speed, heading, pos_x, pos_y, controls[stepped].astype(float),
+                                       acc, max_speed, turn_rate, track_scale), axis=1)
+        return state
+
+    def save(self, filename, robot_ids=None):
+        """Saves the kept steps of the robots in `robot_ids`, all of them by default"""
+        if robot_ids is None:
+            robot_ids = np.arange(self.n_robots)
+        robot_ids = np.asarray(robot_ids, dtype=np.intp)
+        np.savez(filename, controls=self.get_controls()[:, robot_ids], start=self.start_state[robot_ids],
+                 robot_ids=robot_ids, kinematics=self.kinematics, sensors=self.sensors,
+                 version=FORMAT_VERSION)
+
+
+def load(filename):
+    """Returns a dict with the arrays of a saved trace"""
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def replay(trace):
+    """Rebuilds the trajectories of a saved trace. Returns an array of shape
+    (steps + 1, robots, 4) with the speed, heading, x and y of each robot,
+    starting with the state before the first step"""
+    version = int(trace["version"]) if "version" in trace else 1
+    if version != FORMAT_VERSION:
+        raise Exception ("Trace format version {} can not be replayed, version {} is required".format(
+            version, FORMAT_VERSION))
+    controls = trace["controls"]
+    states = np.zeros((len(controls) + 1,) + trace["start"].shape)
+    states[0] = trace["start"]
+    for step, row in enumerate(controls):
+        states[step + 1] = ControlTrace.advance(states[step], row, trace["kinematics"])
+    return states
@@ -4,10 +4,29 @@
 Created on Thu Oct 31 11:05:02 2019
 
 @author: matheus
+
+Conversions between cartesian and polar coordinates
+
+polar2xy, xy2polar and rotate take scalars or arrays. Arrays are broadcast
+against each other, so a whole population of radii and headings is converted
+in one call. Plain numbers go through `math`, which is much faster than NumPy
+for a single value.
 """
 
+import math
+
 import numpy as np
 
+#checked with a plain tuple, isinstance against numbers.Real is slow
+SCALAR_TYPES = (int, float, np.integer, np.floating)
+
+
+def is_scalar(*values):
+    for v in values:
+        if not isinstance(v, SCALAR_TYPES):
+            return False
+    return True
+
 
 class Coordinates:
     @staticmethod
@@ -20,7 +39,9 @@ class Coordinates:
 
     @staticmethod
     def xy2polar(x, y):
-        return Coordinates.z2polar(x + y * 1j)
+        if is_scalar(x, y):
+            return (math.hypot(x, y), math.atan2(y, x))
+        return (np.hypot(x, y), np.arctan2(y, x))
 
     @staticmethod
     def z2xy(z):
@@ -28,4 +49,25 @@ class Coordinates:
 
     @staticmethod
     def polar2xy(r, theta):
-        return Coordinates.z2xy(Coordinates.polar2z(r, theta))
+        if is_scalar(r, theta):
+            return (r * math.cos(theta), r * math.sin(theta))
+        return (r * np.cos(theta), r * np.sin(theta))
+
+    @staticmethod
+    def rotate(x, y, angle):
+        """Rotates (x, y) around the origin by `angle` radians, counterclockwise"""
+        if is_scalar(x, y, angle):
+            c = math.cos(angle)
+            s = math.sin(angle)
+        else:
+            c = np.cos(angle)
+            s = np.sin(angle)
+        return (x * c - y * s, x * s + y * c)
+
+
+polar2z = Coordinates.polar2z
+z2polar = Coordinates.z2polar
+xy2polar = Coordinates.xy2polar
+z2xy = Coordinates.z2xy
+polar2xy = Coordinates.polar2xy
+rotate = Coordinates.rotate
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Early culling of robots that can no longer be selected
+
+Genetic.evolve only keeps the `keep_percent` best robots of a generation, so
+once a robot cannot beat them anymore running it further does not change the
+next generation. With a limit of `max_steps` steps per generation the fitness
+each robot can still reach is bounded (RobotPopulation.get_fitness_bounds).
+At every checkpoint the robots whose highest possible fitness is below the
+lowest fitness the kept robots are already sure to get are stopped.
+
+A stopped robot keeps its fitness, which is below every kept robot, so the
+selected robots are the same as when every robot runs until it dies. With
+several starts per individual the bounds are averaged over the starts and all
+robots of a hopeless individual are stopped together.
+
+The bounds only hold when robots cannot cut across walls while off track, so
+on tracks where they can (RobotPopulation.has_distance_bounds) no robot is
+stopped. The selection is also only the same while the stall detector of
+display.py does not end the generation, as stopped robots no longer count for
+RobotPopulation.any_moved.
+"""
+
+import numpy as np
+
+
+class EarlyCulling:
+    def __init__(self, keep_percent, max_steps, checkpoint_steps=20):
+        self.keep_percent = keep_percent
+        self.max_steps = max_steps
+        self.checkpoint_steps = checkpoint_steps
+        self.culled = 0
+
+    def reset(self):
+        self.culled = 0
+
+    def update(self, population, step):
+        """Call after each population update, `step` being the amount of steps run.
+        Returns the amount of robots culled"""
+        if step >= self.max_steps:
+            population.kill_all()
+            return 0
+        if step % self.checkpoint_steps != 0 or len(population.active) == 0:
+            return 0
+
+        keep = int(population.n_individuals * self.keep_percent)
+        if keep <= 0 or keep >= population.n_individuals:
+            return 0
+
+        idx = population.active
+        low, high = population.get_fitness_bounds(idx, self.max_steps - step)
+        #dead robots fitness does not change anymore
+        low_fitness = population.get_fitness()
+        high_fitness = low_fitness.copy()
+        low_fitness[idx] = low
+        high_fitness[idx] = high
+        #individuals are selected by the mean fitness of their starts
+        low_fitness = population.aggregate(low_fitness)
+        high_fitness = population.aggregate(high_fitness)
+        threshold = np.partition(low_fitness, -keep)[-keep]
+
+        #small margin so rounding can not cull an individual tied with the threshold
+        hopeless = idx[(high_fitness < threshold - 1e-9)[population.owners[idx]]]
+        if len(hopeless):
+            population.kill(hopeless)
+            self.culled += len(hopeless)
+        return len(hopeless)
+
+
+def follow_track(speeds):
+    """Control batch for the check below: each individual drives at its own
+    speed, turning towards the track direction and away from the closest walls.
+    Needs range sensors and the heading input"""
+    def control(inputs, owners):
+        speed = inputs[:, 0]
+        target = speeds[owners]
+        turn = 0.3 * inputs[:, -1] + inputs[:, 1] + inputs[:, 2] - inputs[:, 3] - inputs[:, 4]
+        return np.stack((np.where(speed < target, 100.0, 0), np.where(speed > target, 100.0, 0),
+                         np.maximum(turn, 0) * 50, np.maximum(-turn, 0) * 50), axis=1)
+    return control
+
+
+if __name__ == "__main__":
+    #runs the same population with and without culling on a real track and
+    #checks that culling stops robots early without changing the selection
+    import sys
+
+    from display import Track, Robot
+    from population import RobotPopulation
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'tracks/track_1000x1000_fast_training.png'
+    max_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    t = Track.from_file(filename, (1000, 1000), cache_dir='tracks/cache')
+    t.build_pyramid(2)
+    n_individuals = 100
+    keep_percent = 0.2
+    speeds = np.random.RandomState(0).uniform(0.1, 1.5, n_individuals)
+
+    for level, track in enumerate(t.pyramid):
+        runs = list()
+        for culling in (EarlyCulling(keep_percent, max_steps), None):
+            population = RobotPopulation(n_individuals, 4, 40, 50)
+            population.set_track(track)
+            population.set_sensor_mode(RobotPopulation.SENSOR_RANGE)
+            population.set_heading_input(True)
+            population.set_control_batch(follow_track(speeds))
+            population.reset(track.start_point, Robot.HEADING_MINUS_X)
+            step = 0
+            while population.get_alive_amount():
+                step += 1
+                population.update()
+                if culling is not None:
+                    culling.update(population, step)
+                elif step >= max_steps:
+                    population.kill_all()
+            runs.append((population.get_individual_fitness(), population.steps_run.sum(), culling))
+
+        (culled_fitness, culled_steps, culling), (fitness, steps, _) = runs
+        keep = int(n_individuals * keep_percent)
+        kept = np.argsort(-culled_fitness, kind="stable")[:keep]
+        same = np.array_equal(kept, np.argsort(-fitness, kind="stable")[:keep]) and \
+            np.array_equal(culled_fitness[kept], fitness[kept])
+        print ("Level {}: culled {} robots, {} robot steps instead of {}, same selection {}".format(
+            level, culling.culled, culled_steps, steps, same))
+        if not same:
+            sys.exit(1)
@@ -1,14 +1,19 @@
+import os
 import pygame
 #import random
 import point
 import numpy as np
-from coordinates import Coordinates as coord
-import itertools
 from PIL import Image
-from neural import network, mutation, mutation2
+from neural import create_population, network_batch, mutation, mutation2, SQUASHING_ACTIVATIONS
 from progress.bar import Bar
-import threading
 from genetic import Genetic
+import track_cache
+from tiled_track import TiledTrack
+from population import RobotPopulation
+from robot_core import RobotCore
+from culling import EarlyCulling
+from control_trace import ControlTrace
+import policy
 
 #https://itch.io/game-assets/free
 #http://programarcadegames.com/index.php?chapter=introduction_to_sprites&lang=en
@@ -23,75 +28,25 @@ RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 
 
-class Robot(pygame.sprite.Sprite):
+class Robot(RobotCore, pygame.sprite.Sprite):
     """Robot object based on pygame module
 
-      heading =      0 -> car aligned with  +X
-      heading =   pi/2 -> car aligned with  +Y
-      heading =     pi -> car aligned with  -X
-      heading = 3*pi/2 -> car aligned with  -Y
-
-    sensor IDs example with 8 sensors:
-     x x x x|x x x x
-     0 1 2 3 4 5 6 7
+    The simulation comes from RobotCore. The sprite image is only rotated and
+    moved by refresh_image, when a frame is drawn
     """
-    HEADING_PLUS_X = 0
-    HEADING_PLUS_Y = np.pi/2
-    HEADING_MINUS_X = np.pi
-    HEADING_MINUS_Y = 3*np.pi/2
 
-    id_iter = itertools.count()
+    #rotated images for each heading bucket, shared by robots with the same sensors layout
+    rotated_images = dict()
 
     def __init__(self, color, n_sensors, sensors_pitch=10, sensors_dist=100,
-                 init_point=None, pos=None, heading=HEADING_PLUS_X):
-
-        #moving parameters
-        self.max_speed = 4
-        self.acc = 1
-        self.turn_rate = np.deg2rad(5)
-        
-        #print (init_point)
-
-        #initial conditions
-        if init_point is None:
-            init_point = point.Point(0,0)
-
-        self.speed = 0
-        self.alive = True
-        self.heading = heading
-        self.pos = init_point.copy()
-        self.last_position = self.pos.copy()
-        self.distance_to_finish = 0
-        self.last_distance_to_finish = 0
-        self.last_valid_distance = -1
-        self.steps_without_moving = 0
-        self.steps_without_improving = 0
-        self.steps_off_track = 0
-        self.steps_sensors_off_track = 0
-        self.best_distance = None
-        self.improved_this_step = False
-        self.last_sensor_reads = list()
-        self.steps_run = 0
-
-        #robot config parameters
-        self.n_sensors = n_sensors
-        self.sensors_dist = sensors_dist
-        self.sensors_pitch = sensors_pitch
-        
-        self.max_off_track = 6
-        self.max_without_moving = 80
-        self.max_without_improving = 80
-        self.max_sensors_off_track = 10
-
-        self.calculate_sensor_positions()
-        self.control_func = self.debug_control_func
+                 init_point=None, pos=None, heading=RobotCore.HEADING_PLUS_X, sensor_headings=None,
+                 heading_buckets=360):
+        RobotCore.__init__(self, n_sensors, sensors_pitch, sensors_dist, init_point=init_point,
+                           pos=pos, heading=heading, sensor_headings=sensor_headings)
         self.color = color
 
-        self.id = next(self.id_iter)
-        self.update_count = 0
-
         #prepare sprite
-        super().__init__()
+        pygame.sprite.Sprite.__init__(self)
 
         self.point_radius = 2
         self.margin = self.point_radius
@@ -109,11 +64,6 @@ class Robot(pygame.sprite.Sprite):
                             center.y + (i - (n_sensors-1)/2)*sensors_pitch)
             sensors_pos.append(p)
 
-        if(isinstance(pos, point.Point)):
-            self.pos = pos
-        else:
-            self.pos = point.Point(center.x, center.y)
-
         self.image = pygame.Surface([width, height])
         self.image.fill(BG)
         self.image.set_colorkey(BG)  # Sets the colorkey for tansparency
@@ -124,308 +74,320 @@ class Robot(pygame.sprite.Sprite):
 
         self.original_image = self.image.copy()
         self.rect = self.image.get_rect()
-        self.rect.centerx, self.rect.centery = self.pos.get_int_xy()
-        self.set_angle_rad(heading)
-    
-    def get_inputs_amount (self):
-        return len(self.get_inputs())
-        
-    def set_angle_deg(self, angle_deg):
-        self.set_angle_rad(np.deg2rad(np.remainder(angle_deg, 360)))
-
-    def set_angle_rad(self, angle_rad):
-        new_angle = np.remainder(angle_rad, 2*np.pi)
-        self.heading = new_angle
-
-        angle_deg = np.rad2deg(self.heading)
-
-        self.image = pygame.transform.rotate(self.original_image, angle_deg)
-        self.rect = self.image.get_rect()
-        self.rect.centerx = self.pos.int_x()
-        self.rect.centery = self.pos.int_y()
-
-    def set_pos(self, new_pos):
-        self.last_position = self.pos.copy()
-        self.pos = point.Point(new_pos.x, new_pos.y)
-        self.rect.centerx = self.pos.int_x()
-        self.rect.centery = self.pos.int_y()
-
-    def set_path_read_func(self, path_read):
-        self.path_read_func = path_read
-
-    def debug_control_func(self, inputs):
-        for i in range(len(inputs)):
-            print("[{}]: {}".format(i, inputs[i]))
-        return [1, 0, 1, 0]
-
-    def set_control_func(self, control_func):
-        self.control_func = control_func
-
-    def set_control_unit(self, control_unit):
-        self.control_unit = control_unit
-
-    def set_path_distance_func(self, path_distance_read):
-        self.path_distance_func = path_distance_read
-
-    def get_distance_to_finish(self):
-        return self.distance_to_finish
-
-    def get_last_distance_to_finish(self):
-        if self.alive:
-            return self.distance_to_finish
-        return self.last_distance_to_finish
-    
-    def get_last_valid_distance(self):
-        return self.last_valid_distance
-    
-    def set_max_distance(self, max_distance):
-        self.max_distance = max_distance
 
-    def get_fitness_distances(self):
-        last__valid_dist = self.get_last_valid_distance()
-        max_dist = self.max_distance
-        val = (max_dist - last__valid_dist)/max_dist
-        
-        return val
-    
-    def get_fitness_sensors(self):
-        val = (self.steps_run - self.steps_sensors_off_track) / self.steps_run
-        return val
-    
-    def get_fitness(self):
-        w_dist = 0.9
-        w_sensors = 0.1
-        w_sum = w_dist + w_sensors
-        return (w_dist * self.get_fitness_distances() + w_sensors*self.get_fitness_sensors())/w_sum
-        
-
-    def get_sensor_position(self, sensor_id):
-        # front sensors are numbered from left to right, with `sensors_pitch` distance between them
-        # they are positioned in a line perpendicular to track direction and `sensors_dist` apart from robot's position
-
-        #calculate sensor position without considering heading
-        sensor_x = self.sensors_dist
-        sensor_y = ((self.n_sensors - 1)/2 - sensor_id) * self.sensors_pitch
-
-        #transform into polar coordinates 
-        r, theta = coord.xy2polar(sensor_x, sensor_y)
-
-        #sum heading to theta to calculate sensor position in reference to robot position
-        new_theta = theta + self.heading
-        new_x, new_y = coord.polar2xy(r, new_theta)
-        #calculate final position in reference to track's origin
-        final_sensor_x = self.pos.x + new_x
-        final_sensor_y = self.pos.y - new_y #inverted sign due to inverted Y axis direction
-
-        return point.Point(final_sensor_x, final_sensor_y)
-
-    def calculate_sensor_positions(self):
-        self.sensor_positions = list()
-        for i in range(self.n_sensors):
-            self.sensor_positions.append(self.get_sensor_position(i))
-
-        return list(self.sensor_positions)
-        
-        
-    def check_alive(self):
-        if self.path_read_func(self.pos) is None:
-            self.alive = False
-
-        if self.path_read_func(self.pos) == -1:
-            self.steps_off_track += 1
-            if (self.steps_off_track >= self.max_off_track):
-                self.alive = False
-        else:
-            self.steps_off_track = 0
-        
-        if self.improved_this_step is False:
-            self.steps_without_improving += 1
-            if self.steps_without_improving > self.max_without_improving:
-                self.alive = False
-        else:
-            self.steps_without_improving = 0
-        
-        if self.steps_without_moving >= self.max_without_moving:
-            self.alive = False
-        
-        return self.alive
-
-    def check_moved(self):
-        if self.alive and self.last_position != self.pos:
-            self.moved = True
-        else:
-            self.moved = False
-            self.steps_without_moving += 1
-        self.last_position = self.pos.copy()
-        return self.moved
-    
-    def check_sensors_off_track(self):
-        if len(self.last_sensor_reads) > 0:
-            if len([i for i in self.last_sensor_reads if i >= 0]) == 0:
-                self.steps_sensors_off_track += 1
-
-    def calc_new_position(self):
-        x, y = coord.polar2xy(self.speed, self.heading)
-        delta = point.Point(x, -y)
-        self.set_pos(self.pos + delta)
-
-    def calc_new_distances(self):
-        if(self.alive):
-            self.last_distance_to_finish = self.distance_to_finish
-            self.distance_to_finish = self.path_distance_func(self.pos)
-        if (self.distance_to_finish >= 0):
-            self.last_valid_distance = self.distance_to_finish
-        #store best distance value achieved so far
-        if (self.best_distance is None):
-            self.best_distance = self.last_valid_distance
-        else:
-            if (self.last_valid_distance < self.best_distance):
-                self.best_distance = self.last_valid_distance
-                self.improved_this_step = True
-            else:
-                self.improved_this_step = False
-
-    def reset(self, start_point, start_heading_rad):
-        self.alive = True
-        self.set_pos(start_point)
-        self.set_angle_rad(start_heading_rad)
-        self.speed = 0
-        self.moved = False
-        self.steps_without_moving = 0
-        self.steps_without_improving = 0
-        self.steps_off_track = 0
-        self.best_distance = None
-        self.improved_this_step = False
-        self.last_sensor_reads = list()
-        self.steps_sensors_off_track = 0
-        self.steps_run = 0
-
-    def get_inputs(self):
-        inputs = list()
-        inputs.append(self.speed)
-        self.last_sensor_reads = list()
-        for s in self.calculate_sensor_positions():
-            read = self.path_read_func(s)
-            inputs.append(read)
-            self.last_sensor_reads.append(read)
-        return inputs
-
-    def update(self):
-        if self.alive is False:
-            return False
-        self.update_count += 1
-        self.steps_run += 1
-
-        acc, brake, left, right = self.control_func(self.get_inputs())
-        self.check_sensors_off_track()
-        
-        if acc:
-#            speed_acc = self.acc * (np.arctan(acc) / (np.pi * 2))
-            speed_change = self.acc * (np.arctan(acc) / (np.pi * 2))
-            self.speed = min(self.speed + speed_change, self.max_speed)
-        if brake:
-#            speed_brake = self.acc * (np.arctan(brake) / (np.pi * 2))
-            speed_change = self.acc * (np.arctan(brake) / (np.pi * 2))
-            self.speed = max(self.speed - speed_change, (-1)*self.max_speed)
-        if left:
-#            angle_left = self.turn_rate * (np.arctan(left) / (np.pi * 2))
-            turn_angle = self.turn_rate * (np.arctan(left) / (np.pi * 2))
-            self.set_angle_rad(self.heading + turn_angle)
-        if right:
-#            angle_right = self.turn_rate * (np.arctan(right) / (np.pi * 2))
-            turn_angle = self.turn_rate * (np.arctan(right) / (np.pi * 2))
-            self.set_angle_rad(self.heading - turn_angle)
-
-        #limit heading to pi
-        self.calc_new_position()
-        self.check_alive()
-        self.check_moved()
-        if(self.alive is False):
-            self.set_pos(self.last_position)
-        self.calc_new_distances()
-        return True
+        #drawn headings are rounded to one of `heading_buckets` evenly spaced angles
+        self.heading_buckets = heading_buckets
+        key = (n_sensors, sensors_pitch, sensors_dist, heading_buckets)
+        if key not in self.rotated_images:
+            self.rotated_images[key] = [None] * heading_buckets
+        self.rotations = self.rotated_images[key]
+        self.drawn_bucket = None
+        self.refresh_image()
+
+    def get_screen_pos(self):
+        """Robot position in full resolution pixels, as the screen is drawn"""
+        if self.track_scale == 1:
+            return self.pos.get_int_xy()
+        return (int(round(self.pos.x / self.track_scale)), int(round(self.pos.y / self.track_scale)))
+
+    def get_rotated_image(self, bucket):
+        image = self.rotations[bucket]
+        if image is None:
+            image = pygame.transform.rotate(self.original_image, bucket * 360 / self.heading_buckets)
+            self.rotations[bucket] = image
+        return image
+
+    def refresh_image(self):
+        """Brings the sprite image and rect up to the robot state. Images come from
+        the shared rotations, each one is only rotated the first time it is drawn"""
+        bucket = int(round(self.heading * self.heading_buckets / (2*np.pi))) % self.heading_buckets
+        if self.drawn_bucket != bucket:
+            self.image = self.get_rotated_image(bucket)
+            self.rect = self.image.get_rect()
+            self.drawn_bucket = bucket
+        self.rect.centerx, self.rect.centery = self.get_screen_pos()
 
 
 class Track (pygame.sprite.Sprite):
-    OFF_TRACK = (-1)
+    OFF_TRACK = track_cache.OFF_TRACK
     ON_TRACK = (1)
 
     START_VALUE = (-2)
     EMPTY_DISTANCE = (-10)
-    END_VALUE = (0)
+    END_VALUE = track_cache.END_VALUE
+    OUT_OF_BOUNDS = track_cache.OUT_OF_BOUNDS
 
     START_COLOR     = (0, 255, 0)
     END_COLOR       = (255, 0, 0)
     OFF_TRACK_COLOR = (0, 0, 0)
     ON_TRACK_COLOR  = (255, 255, 255)
 
+    #path only holds the small values above, distances need room for long tracks
+    PATH_DTYPE = np.int8
+    DISTANCE_DTYPE = np.int32
+
 
-    def __init__(self, image):
+    def __init__(self, image=None):
         super().__init__()
         self.end_points = list()
         self.shortest_distance = None
         self.distances_plot = None
         self.start_point = None
-        self.from_image(image)
+        #track cells per full resolution pixel, lower than 1 on pyramid levels
+        self.scale = 1
+        self.pyramid = [self]
+        if image is not None:
+            self.from_image(image)
+
+    @classmethod
+    def from_file(cls, filename, size=None, cache_dir=None):
+        """Loads the track image at `filename`, resized to `size` if given.
+        With `cache_dir` the compiled track is stored there and later runs
+        skip decoding the image and calculating the distances"""
+        if cache_dir is None:
+            return cls(cls.open_image(filename, size))
+
+        key = track_cache.cache_key(filename, size)
+        t = cls()
+        if track_cache.is_cached(cache_dir, key):
+            print("Loading cached track", key)
+            t.from_cache(track_cache.load_track(cache_dir, key))
+        else:
+            t.from_image(cls.open_image(filename, size))
+            track_cache.save_track(t, cache_dir, key)
+        return t
+
+    @staticmethod
+    def open_image(filename, size=None):
+        im = Image.open(filename)
+        if size is not None:
+            im = im.resize(size)
+        return im
+
+    def from_cache(self, data):
+        self.path = data["path"]
+        self.distances = data["distances"]
+        self.wall_distances = data["wall_distances"]
+        self.directions = data["directions"]
+        self.size_y, self.size_x = self.path.shape
+        if data["start_point"] is not None:
+            self.start_point = point.Point(*data["start_point"])
+        self.end_points = [point.Point(x, y) for x, y in data["end_points"]]
+        self.max_distance = data["max_distance"]
+        self.shortest_distance = data["shortest_distance"]
+
+        self.create_track_background()
+        self.create_distances_background()
+        self.image = self.track_image
+        self.rect = self.track_image.get_rect()
+
 
+    @classmethod
+    def compile_file (cls, filename, size=None, cache_dir='tracks/cache'):
+        """Makes sure the track at `filename` is in the cache without keeping it
+        loaded. Returns its cache key"""
+        key = track_cache.cache_key(filename, size)
+        if not track_cache.is_cached(cache_dir, key):
+            cls.from_file(filename, size, cache_dir)
+        return key
+
+    @classmethod
+    def from_cached_path (cls, cache_dir, key, factor):
+        """Coarse copy of the track cached under `key`, each cell covering
+        factor x factor cells. Only the memory mapped path grid is read, one
+        band at a time, so the full resolution grids are never loaded"""
+        data = track_cache.load_track(cache_dir, key)
+        start_point = None
+        if data["start_point"] is not None:
+            start_point = point.Point(data["start_point"][0] // factor, data["start_point"][1] // factor)
+        return cls.from_path(cls.downsample_path(data["path"], factor), 1 / factor, start_point)
+
+    @classmethod
+    def downsample_path (cls, path, factor, band=256):
+        """Path grid with each cell covering factor x factor cells of `path`. A coarse
+        cell is on track when at least half of its cells are, and it is an end cell
+        when any of its cells is. `band` coarse rows are read at a time"""
+        size_y = path.shape[0] // factor
+        size_x = path.shape[1] // factor
+        coarse = np.full((size_y, size_x), cls.OFF_TRACK, dtype=cls.PATH_DTYPE)
+        for y0 in range(0, size_y, band):
+            y1 = min(y0 + band, size_y)
+            blocks = np.asarray(path[y0 * factor:y1 * factor, :size_x * factor]).reshape(y1 - y0, factor, size_x, factor)
+            on_track = (blocks != cls.OFF_TRACK).mean(axis=(1, 3)) >= 0.5
+            is_end = (blocks == cls.END_VALUE).any(axis=(1, 3))
+            rows = coarse[y0:y1]
+            rows[on_track] = cls.ON_TRACK
+            rows[is_end] = cls.END_VALUE
+        return coarse
+
+    def downsample (self, factor):
+        """Returns a coarser copy of the track, each cell covering factor x factor cells"""
+        start_point = None
+        if self.start_point is not None:
+            start_point = point.Point(self.start_point.x // factor, self.start_point.y // factor)
+        return self.from_path(self.downsample_path(self.path, factor), self.scale / factor, start_point)
+
+    @classmethod
+    def from_path (cls, path, scale=1, start_point=None):
+        """Track over a path grid, with its distances, walls and directions calculated"""
+        t = cls()
+        t.scale = scale
+        t.size_y, t.size_x = path.shape
+        t.path = path
+        t.start_point = start_point
+        end_x, end_y = np.nonzero((path == cls.END_VALUE).T)
+        for x, y in zip(end_x.tolist(), end_y.tolist()):
+            t.end_points.append(point.Point(x, y))
+
+        t.create_track_background()
+        t.calc_distances()
+        t.calc_wall_distances()
+        t.calc_directions()
+        t.create_distances_background()
+        t.image = t.track_image
+        t.rect = t.track_image.get_rect()
+        return t
+
+    def build_pyramid (self, levels):
+        """Fills self.pyramid with this track followed by `levels` coarser copies,
+        each one with half the resolution of the previous"""
+        self.pyramid = [self]
+        for i in range(levels):
+            self.pyramid.append(self.pyramid[-1].downsample(2))
+        return self.pyramid
 
     def calc_distances (self, print_steps=False):
         print("\nStarting to calculate distances")
-        finished = False
-        self.distances = np.array(self.path)
-        for cell in np.nditer(self.distances, op_flags=['readwrite']):
-            if cell == self.ON_TRACK:
-                cell[...] = self.EMPTY_DISTANCE
-            elif cell == self.START_VALUE:
-                cell[...] = self.START_VALUE
-            else:
-                cell[...] = self.OFF_TRACK
+        self.distances = np.full(self.path.shape, self.OFF_TRACK, dtype=self.DISTANCE_DTYPE)
+        self.distances[self.path == self.ON_TRACK] = self.EMPTY_DISTANCE
+        self.distances[self.path == self.START_VALUE] = self.START_VALUE
 
         for end in self.end_points:
             self.set_distance(end, self.END_VALUE)
 
-        next_points = list(self.end_points)
+        #flood fill level by level, the frontier holds flat indices into distances
+        flat = self.distances.reshape(-1)
+        cells = flat.size
+        frontier = np.array([p.int_y() * self.size_x + p.int_x() for p in self.end_points], dtype=np.intp)
+        p_dist = self.END_VALUE
 
-        while (finished == False):
+        while (len(frontier) > 0):
             if (print_steps):
                 self.print_distances()
-        
-            now_points = list(next_points)
-            next_points = list()
-
-            for p in now_points:
-
-                p_dist = self.get_distance(p)
-                neighbors = ((-1,0), (1,0), (0,-1), (0,1))
-
-                for dx,dy in neighbors:
-                    x = p.x + dx
-                    y = p.y + dy
-                    if x < 0 or x >= self.size_x or y < 0 or y >= self.size_y:
-                        continue
-                    else:
-                        this_p = point.Point(x,y)
-                        this_distance = self.get_distance(this_p) 
-                        if this_distance == self.OFF_TRACK:
-                            continue
-                        if this_distance > 0:    #calculated
-                            continue
-                        if this_distance == self.END_VALUE:
-                            continue
-                        if this_distance == self.START_VALUE:
-                            if (self.shortest_distance == None):
-                                self.shortest_distance = p_dist
-                            continue
-
-                        self.set_distance(this_p, p_dist + 1)
-                        next_points.append(this_p)
-            
-            self.max_distance = self.distances.max()
 
-            if (len(next_points) == 0):
-                finished = True
+            frontier_x = frontier % self.size_x
+            neighbors = np.concatenate((
+                frontier[frontier_x > 0] - 1,
+                frontier[frontier_x < self.size_x - 1] + 1,
+                frontier[frontier >= self.size_x] - self.size_x,
+                frontier[frontier < cells - self.size_x] + self.size_x))
+            values = flat[neighbors]
+
+            if self.shortest_distance == None and np.any(values == self.START_VALUE):
+                self.shortest_distance = p_dist
+
+            frontier = np.unique(neighbors[values == self.EMPTY_DISTANCE])
+            p_dist += 1
+            flat[frontier] = p_dist
+
+        self.max_distance = self.distances.max()
         print (self.distances)
 
+    def calc_wall_distances (self):
+        """Distance from every cell to the closest off track cell, counted in
+        8-connected steps. It is never larger than the euclidean distance, so a
+        ray can safely advance by it. Cells outside the grid count as off track"""
+        #pad the grid with an off track border, it also keeps neighbors from wrapping rows
+        size_x = self.size_x + 2
+        walls = np.ones((self.size_y + 2, size_x), dtype=bool)
+        walls[1:-1, 1:-1] = self.path == self.OFF_TRACK
+        field = np.where(walls, 0, self.EMPTY_DISTANCE).astype(self.DISTANCE_DTYPE)
+
+        flat = field.reshape(-1)
+        offsets = (-1, 1, -size_x, size_x, -size_x - 1, -size_x + 1, size_x - 1, size_x + 1)
+        frontier = np.flatnonzero(walls)
+        wall_dist = 0
+
+        while (len(frontier) > 0):
+            neighbors = np.concatenate([frontier + offset for offset in offsets])
+            neighbors = neighbors[(neighbors >= 0) & (neighbors < flat.size)]
+            frontier = np.unique(neighbors[flat[neighbors] == self.EMPTY_DISTANCE])
+            wall_dist += 1
+            flat[frontier] = wall_dist
+
+        self.wall_distances = np.array(field[1:-1, 1:-1])
+
+    def calc_geodesic_distances (self, band=0.5):
+        """Euclidean-like distance to the end through the track for every reachable
+        cell, inf elsewhere. The BFS distances count 4-connected steps, so their
+        gradient only points in a few directions. This solves |grad T| = 1 with
+        fast marching instead, every cell less than `band` above the smallest
+        tentative distance being accepted at once"""
+        size_x = self.size_x + 2
+        reachable = np.pad(self.distances >= self.END_VALUE, 1)
+        field = np.full(reachable.shape, np.inf)
+        flat = field.reshape(-1)
+        flat_reachable = reachable.reshape(-1)
+        accepted = np.zeros(flat.size, dtype=bool)
+
+        considered = np.array([(p.int_y() + 1) * size_x + p.int_x() + 1 for p in self.end_points], dtype=np.intp)
+        considered = np.unique(considered[flat_reachable[considered]])
+        flat[considered] = 0
+
+        #the padding is never reachable, so neighbors of accepted cells stay inside the grid
+        offsets = np.array((-1, 1, -size_x, size_x))
+        while (len(considered) > 0):
+            values = flat[considered]
+            take = values < values.min() + band
+            newly = considered[take]
+            accepted[newly] = True
+
+            neighbors = np.unique((newly[:, None] + offsets).reshape(-1))
+            neighbors = neighbors[flat_reachable[neighbors] & ~accepted[neighbors]]
+            #upwind update from the accepted neighbors on each axis
+            known = [np.where(accepted[cells], flat[cells], np.inf) for cells in neighbors + offsets[:, None]]
+            a = np.minimum(known[0], known[1])
+            b = np.minimum(known[2], known[3])
+            diff = np.abs(a - b)
+            with np.errstate(invalid="ignore"):
+                both = (a + b + np.sqrt(np.maximum(2 - diff * diff, 0))) / 2
+            flat[neighbors] = np.minimum(flat[neighbors], np.where(diff >= 1, np.minimum(a, b) + 1, both))
+
+            considered = np.union1d(considered[~take], neighbors)
+
+        return field[1:-1, 1:-1]
+
+    def calc_directions (self):
+        """Direction towards the end from every reachable cell: the angle of the
+        negative gradient of the geodesic distances, averaged over the 3x3
+        neighborhood. Angles follow the robot heading convention, NaN where there
+        is no direction"""
+        reachable = self.distances >= self.END_VALUE
+        dist = np.pad(np.where(reachable, self.calc_geodesic_distances(), 0).astype(np.float32), 1)
+        valid = np.pad(reachable, 1)
+        center = dist[1:-1, 1:-1]
+
+        def slope(y, x):
+            #one sided difference towards the (y, x) shifted neighbor, 0 when it is not reachable
+            shifted = (slice(1 + y, dist.shape[0] - 1 + y), slice(1 + x, dist.shape[1] - 1 + x))
+            return np.where(valid[shifted] & reachable, dist[shifted] - center, 0)
+
+        #Y grows downwards on the grid
+        grad_x = slope(0, -1) - slope(0, 1)
+        grad_y = slope(-1, 0) - slope(1, 0)
+
+        grad_x = np.pad(np.where(reachable, grad_x, 0), 1)
+        grad_y = np.pad(np.where(reachable, grad_y, 0), 1)
+        sum_x = np.zeros(center.shape, dtype=np.float32)
+        sum_y = np.zeros(center.shape, dtype=np.float32)
+        for y in range(3):
+            for x in range(3):
+                sum_x += grad_x[y:y + self.size_y, x:x + self.size_x]
+                sum_y += grad_y[y:y + self.size_y, x:x + self.size_x]
+
+        self.directions = np.arctan2(-sum_y, sum_x).astype(np.float32)
+        self.directions[~reachable | ((sum_x == 0) & (sum_y == 0))] = np.nan
+
     def set_start_point (self, start_point):
         self.start_point = start_point
 
@@ -438,7 +400,8 @@ class Track (pygame.sprite.Sprite):
         if point.x >= self.size_x or point.y >= self.size_y or \
             point.x < 0 or point.y < 0:
             return None
-        return self.distances[point.int_y()][point.int_x()]
+        x, y = point.get_int_xy()
+        return self.distances[y, x]
 
     def set_distance (self, point, value):
         self.distances[point.int_y()][point.int_x()] = value
@@ -447,77 +410,146 @@ class Track (pygame.sprite.Sprite):
         if point.x >= self.size_x or point.y >= self.size_y or \
             point.x < 0 or point.y < 0:
             return self.OFF_TRACK
-        return self.path[point.int_y()][point.int_x()]
+        x, y = point.get_int_xy()
+        return self.path[y, x]
 
     def set_path (self, point, value):
         self.path[point.int_y()][point.int_x()] = value
 
+    def get_path_many (self, xs, ys):
+        """get_path for arrays of coordinates, OFF_TRACK outside the track"""
+        return self.read_many(self.path, xs, ys, self.OFF_TRACK)
+
+    def get_wall_distance (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return 0
+        x, y = point.get_int_xy()
+        return self.wall_distances[y, x]
+
+    def get_direction (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return np.nan
+        x, y = point.get_int_xy()
+        return self.directions[y, x]
+
+    def get_direction_many (self, xs, ys):
+        """get_direction for arrays of coordinates, NaN outside the track"""
+        return self.read_many(self.directions, xs, ys, np.nan)
+
+    def get_wall_distance_many (self, xs, ys):
+        """get_wall_distance for arrays of coordinates, 0 outside the track"""
+        return self.read_many(self.wall_distances, xs, ys, 0)
+
+    def get_distance_many (self, xs, ys):
+        """get_distance for arrays of coordinates, OUT_OF_BOUNDS outside the track"""
+        return self.read_many(self.distances, xs, ys, self.OUT_OF_BOUNDS)
+
+    def get_start_poses (self, n_starts, start_heading, heading_noise=0, rng=np.random, scale=None, start_point=None):
+        """(x, y, heading) of `n_starts` start poses spread along the track. The first
+        one is the track start point, the others are the cells at evenly spaced
+        distances from the end, as far from the walls as possible, heading along
+        the track direction. A normal noise of `heading_noise` radians is added to
+        the headings of all but the first pose.
+
+        With `scale` the poses are given in the cells of another level of the same
+        map, such as a tiled level without full grids, whose start point is `start_point`"""
+        start_x, start_y = self.start_point.get_int_xy()
+        factor = 1 if scale is None else scale / self.scale
+        first = start_point.get_int_xy() if start_point is not None else (start_x, start_y)
+        poses = [first + (start_heading,)]
+        start_distance = self.distances[start_y, start_x]
+        if start_distance < self.END_VALUE:
+            start_distance = self.max_distance
+        flat_distances = self.distances.reshape(-1)
+        for k in range(1, n_starts):
+            target = int(start_distance * (n_starts - k) / n_starts)
+            cells = np.flatnonzero(flat_distances == target)
+            if len(cells) == 0:
+                reachable = np.flatnonzero(flat_distances >= self.END_VALUE)
+                target = flat_distances[reachable[np.argmin(np.abs(flat_distances[reachable] - target))]]
+                cells = np.flatnonzero(flat_distances == target)
+            cell = cells[np.argmax(self.wall_distances.reshape(-1)[cells])]
+            y, x = divmod(int(cell), self.size_x)
+            heading = self.directions[y, x]
+            if np.isnan(heading):
+                heading = start_heading
+            if factor != 1:
+                #center of the coarse cell in the cells of the finer level
+                x = (x + 0.5) * factor - 0.5
+                y = (y + 0.5) * factor - 0.5
+            poses.append((x, y, float(heading) + rng.normal(0, heading_noise)))
+        return poses
+
+    def read_many (self, grid, xs, ys, outside_value):
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        #np.rint rounds halves to even, like the round() used by Point
+        int_x = np.rint(xs)
+        int_y = np.rint(ys)
+        inside = (xs >= 0) & (ys >= 0) & (int_x < self.size_x) & (int_y < self.size_y)
+
+        values = np.full(xs.shape, outside_value, dtype=grid.dtype)
+        values[inside] = grid[int_y[inside].astype(np.intp), int_x[inside].astype(np.intp)]
+        return values
+
     def from_image (self, track_image):
         self.size_x = track_image.size[0]
         self.size_y = track_image.size[1]
         self.image = track_image.copy()
-        self.path = np.ones((self.size_y, self.size_x)) * self.OFF_TRACK
-
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                p = point.Point(x,y)
-                pix = self.image.getpixel((x,y))
-                if pix == self.START_COLOR:
-                    if self.start_point == None:
-                        self.start_point = p
-                    self.set_path(p, self.ON_TRACK)
-                    continue
-                if pix == self.END_COLOR:
-                    self.set_path(p, self.END_VALUE)
-                    self.end_points.append(p)
-                    continue
-                if pix == self.ON_TRACK_COLOR:
-                    self.set_path(p, self.ON_TRACK)
-                    continue
-                if pix == self.OFF_TRACK_COLOR:
-                    self.set_path(p, self.OFF_TRACK)
-                    continue
-                
+        self.path = np.full((self.size_y, self.size_x), self.OFF_TRACK, dtype=self.PATH_DTYPE)
+
+        #classify every pixel at once, pixels[y][x] holds the (R,G,B) color
+        pixels = np.asarray(self.image.convert("RGB"))
+        start_mask = np.all(pixels == self.START_COLOR, axis=-1)
+        end_mask = np.all(pixels == self.END_COLOR, axis=-1)
+        on_track_mask = np.all(pixels == self.ON_TRACK_COLOR, axis=-1)
+
+        self.path[on_track_mask | start_mask] = self.ON_TRACK
+        self.path[end_mask] = self.END_VALUE
+
+        #points are listed scanning X first and then Y, as the pixel walk did
+        if self.start_point == None:
+            start_x, start_y = np.nonzero(start_mask.T)
+            if len(start_x) > 0:
+                self.start_point = point.Point(int(start_x[0]), int(start_y[0]))
+        end_x, end_y = np.nonzero(end_mask.T)
+        for x, y in zip(end_x.tolist(), end_y.tolist()):
+            self.end_points.append(point.Point(x, y))
+
         self.create_track_background()
         self.calc_distances()
+        self.calc_wall_distances()
+        self.calc_directions()
         self.create_distances_background()
         
         self.image = self.track_image
         self.rect = self.track_image.get_rect()
         
     def create_track_background(self):
-        self.track_image = pygame.Surface((self.size_x, self.size_y))
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                p = point.Point(x,y)
-                val = self.get_path(p)
-                if val == self.ON_TRACK:
-                    self.track_image.set_at((p.x, p.y), self.ON_TRACK_COLOR)
-                elif val == self.END_VALUE:
-                    self.track_image.set_at((p.x, p.y), self.END_COLOR)
-                else:
-                    self.track_image.set_at((p.x, p.y), self.OFF_TRACK_COLOR)            
+        #pixels[y][x] holds the (R,G,B) color, surfarray expects it indexed by [x][y]
+        pixels = np.empty((self.size_y, self.size_x, 3), dtype=np.uint8)
+        pixels[...] = self.OFF_TRACK_COLOR
+        pixels[self.path == self.ON_TRACK] = self.ON_TRACK_COLOR
+        pixels[self.path == self.END_VALUE] = self.END_COLOR
+        self.track_image = pygame.surfarray.make_surface(pixels.swapaxes(0, 1))
     
     
     def create_distances_background(self):
         print("\nPreparing to distances backgroud")
         print ("max distance:", self.max_distance)
         print ("min distance:", self.shortest_distance)
-        self.distances_image = pygame.Surface((self.size_x, self.size_y))
         color_gain = (255 - 40) / self.max_distance
-        self.distances_image.fill((0,0,0))
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                p = point.Point(x,y)
-                dist = self.get_distance(p)
-                if (dist > 0):
-                    R = (int(dist * color_gain) + 40)
-                    G = 40
-                    B = 40
-                    color = (R,G,B)
-                    if (dist % 20 == 0):
-                        color = (255,255,255)
-                    self.distances_image.set_at((p.x, p.y), color)
+        pixels = np.zeros((self.size_y, self.size_x, 3), dtype=np.uint8)
+
+        calculated = self.distances > 0
+        dist = self.distances[calculated]
+        colors = np.full((len(dist), 3), 40, dtype=np.uint8)
+        colors[:, 0] = (dist * color_gain).astype(np.uint8) + 40
+        colors[dist % 20 == 0] = (255, 255, 255)
+        pixels[calculated] = colors
+
+        self.distances_image = pygame.surfarray.make_surface(pixels.swapaxes(0, 1))
         self.distances_image.set_at((10, 50), (0, 255, 0))
         self.distances_image.set_at((11, 50), (0, 255, 0))
         self.distances_image.set_at((10, 51), (0, 255, 0))
@@ -526,9 +558,16 @@ class Track (pygame.sprite.Sprite):
 def update():
     pygame.display.flip()
 
-def update_thread (sprite_group, surface):
-    sprite_group.update()
-    sprite_group.draw(surface)
+def sync_sprites (population, sprites, idx=None):
+    """Moves the robot sprites in `idx` (all of them by default) to the state
+    of the simulated population, only called when a frame is drawn"""
+    if idx is None:
+        idx = range(len(sprites))
+    for i in idx:
+        r = sprites[i]
+        r.heading = population.heading[i]
+        r.pos.set(population.pos_x[i], population.pos_y[i])
+        r.refresh_image()
     
 def get_key_movement(inputs):
     got_event = False
@@ -606,112 +645,189 @@ if __name__ == "__main__":
     #filename = 'tracks/test6.png'
 
 
-    im = Image.open(filename)
-    t = Track(im.resize((1000,1000)))
-
-
-    screen_width = t.size_x
-    screen_height = t.size_y
+    track_size = (1000,1000)
+    cache_dir = 'tracks/cache'
+
+    #coarse to fine training: first generations run over coarser copies of the track
+    #and the population is promoted to the next finer level after
+    #`generations_per_level` generations or as soon as a robot reaches the end
+    pyramid_levels = 2
+    generations_per_level = 10
+
+    #read the full resolution level from tiles on disk, keeping only the tiles
+    #robots are driving over in memory. The full track is only loaded the first
+    #time, to compile it, and `t` is then the first coarse level. It is where
+    #start poses and backgrounds of the full resolution level come from
+    use_tiles = False
+    if use_tiles:
+        key = Track.compile_file(filename, track_size, cache_dir)
+        t = Track.from_cached_path(cache_dir, key, 2)
+        levels = [TiledTrack.from_cache(cache_dir, key, tile_size=256, max_tiles=64)] + t.build_pyramid(pyramid_levels - 1)
+        level_views = [t] + t.pyramid
+    else:
+        t = Track.from_file(filename, track_size, cache_dir=cache_dir)
+        levels = list(t.build_pyramid(pyramid_levels))
+        level_views = levels
+    level = len(levels) - 1
+
+    screen_width = levels[0].size_x
+    screen_height = levels[0].size_y
     screen = pygame.display.set_mode([screen_width, screen_height])
     pygame.display.set_caption("IA follow")
 
-    background_list = pygame.sprite.Group()
-    background_list.add(t)
-
     robots_list = pygame.sprite.Group()
 
-    start_pos = t.start_point
+    start_pos = levels[0].start_point
     start_heading = Robot.HEADING_MINUS_X
 
+    level_generations = 0
+    level_background = None
+
     indiv = 100
     max_gen = 20000
+    heading_buckets = 360
 
-    threads_count = 8
-    robot_groups = list()
-    for i in range(threads_count):
-        robot_groups.append(pygame.sprite.Group())
+    sensor_mode = Robot.SENSOR_POINTS
+    # sensor_mode = Robot.SENSOR_RANGE
+    heading_input = False
 
+    #robots kept by the genetic algorithm on each generation
+    keep_percent = 0.20
 
-    if (key_control):
-        indiv = 1
+    #stop robots that can not be kept anymore, generations are then limited
+    #to `max_steps` steps so the reachable fitness can be bounded
+    use_culling = False
+    culling = None
+    if use_culling:
+        culling = EarlyCulling(keep_percent, max_steps=2000, checkpoint_steps=20)
 
-    neurals = list()
+    #every individual runs from `n_starts` start poses along the track and is
+    #selected by its mean fitness, so it does not overfit to a single start.
+    #Each start is a full run, a generation costs `n_starts` times as much
+    n_starts = 1
+    start_heading_noise = np.deg2rad(10)
 
-    for i in range(indiv):
-        r = Robot(WHITE, 4, 10, 50, heading=start_heading, pos=start_pos)
-        r.set_path_read_func(t.get_path)
-        r.set_path_distance_func(t.get_distance)
-        
-        req_inputs = len(r.get_inputs())
-        n = network (req_inputs, (4, 4, 4))
-        neurals.append(n)
-        r.set_control_func(n.evaluate)
-        r.set_control_unit(neurals[i])
+    if (key_control):
+        indiv = 1
+        n_starts = 1
+
+    #the population runs the simulation, sprites only draw it
+    population = RobotPopulation(indiv, 4, 10, 50, heading=start_heading, n_starts=n_starts)
+    population.set_track(levels[level])
+    population.set_sensor_mode(sensor_mode)
+    population.set_heading_input(heading_input)
+    req_inputs = population.get_inputs_amount()
+
+    control_funcs = list()
+
+    #activation of each layer, the last "relu_arctan" layer squashes the controls
+    #inside the network. np.float32 halves the memory read per inference
+    activations = ("relu", "relu", "relu_arctan")
+    network_dtype = np.float64
+
+    #the gains of every network are the rows of `genomes`
+    genomes, neurals = create_population(indiv, req_inputs, (4, 4, 4), activations, dtype=network_dtype)
+    for i, n in enumerate(neurals):
+        control_funcs.append(n.evaluate)
         
-        # r.set_control_func(simple_control)
-        r.set_max_distance(t.max_distance)
+        # control_funcs[i] = simple_control
         
         if (key_control):
-            r.set_control_func(get_key_movement)
-        
+            control_funcs[i] = get_key_movement
+
+    #one sprite per simulated robot, each start of an individual is drawn
+    for i in range(population.n_robots):
+        r = Robot(WHITE, 4, 10, 50, heading=start_heading, pos=start_pos, heading_buckets=heading_buckets)
+        r.set_control_unit(neurals[population.owners[i]])
         robots_list.add(r)
-        
-        robot_groups[i%threads_count].add(r)
+
+    population.set_control_funcs(control_funcs)
+    #the whole population is evaluated in one batch, a view of `genomes`
+    batch = network_batch(neurals, genomes)
+    if not key_control:
+        population.set_control_batch(batch.evaluate)
+        population.set_squash_controls(activations[-1] not in SQUASHING_ACTIVATIONS)
+
+    #record the controls of every robot, the best robots of each generation are
+    #saved to `trace_file` and can be watched with replay.py while training headless
+    record_traces = True
+    trace_file = 'traces/last_generation.npz'
+    if record_traces:
+        population.set_trace(ControlTrace(population.n_robots, capacity=4096))
+
+    #the best network of each generation is exported with the robot setup, it
+    #runs with policy.load and NumPy only
+    export_policy = True
+    policy_file = 'policies/best.npz'
 
     graphics_enabled = True
     generation = 0
     generation_scores = list()
-    bar = Bar('Processing', max=t.max_distance)
+    bar = Bar('Processing', max=levels[0].max_distance)
     bar.check_tty = False
     for g in range (max_gen):
         bar.goto(0)
-        print ("Starting generation {}".format(generation))
+        if level > 0 and level_generations >= generations_per_level:
+            level -= 1
+            level_generations = 0
+            level_background = None
+        level_generations += 1
+        level_track = levels[level]
+        if level_background is None:
+            level_background = pygame.transform.scale(level_views[level].distances_image, (screen_width, screen_height))
+
+        print ("Starting generation {} on track level {} ({}x{})".format(generation, level, level_track.size_x, level_track.size_y))
+        #same start poses for every individual
+        start_poses = level_views[level].get_start_poses(n_starts, start_heading, start_heading_noise,
+                                                         scale=level_track.scale, start_point=level_track.start_point)
+        population.set_track(level_track)
+        population.reset(level_track.start_point, start_heading, start_poses)
+        if culling is not None:
+            culling.reset()
         for r in robots_list.sprites():
-            r.reset(start_pos, start_heading)
+            r.set_track(level_track)
+            r.reset(level_track.start_point, start_heading)
         
         step = 0
         alive = True
         stalled_count = 0
         robots = robots_list.sprites()
+        #sprites of dead robots stay where they died, only the stepped ones are moved
+        full_sync = True
         while(alive):
-            
-    #        screen.blit(t.track_image, (0,0))
-            screen.blit(t.distances_image, (0,0))
-            
             step += 1
-            alive = 0
-            moved = False
-            
-            threads = list()
-            for i, g in enumerate(robot_groups):
-                x = threading.Thread(target=update_thread, args=(g, screen))
-                x.start()
-                threads.append(x)
-            
-            for i, x in enumerate(threads):
-                x.join()
+            population.update()
+            if culling is not None:
+                culling.update(population, step)
+            #nothing is drawn with graphics disabled, headless steps only simulate
+            drawn = graphics_enabled
+            if (graphics_enabled):
+        #        screen.blit(t.track_image, (0,0))
+                screen.blit(level_background, (0,0))
+                if full_sync:
+                    sync_sprites(population, robots)
+                    full_sync = False
+                else:
+                    sync_sprites(population, robots, population.stepped.tolist())
+                robots_list.draw(screen)
             
             for event in pygame.event.get():
                 if event.type == pygame.KEYUP:
                     if event.key == pygame.K_k:
                         print ("Kill everyone")
-                        for r in robots:
-                            r.alive = False
+                        population.kill_all()
                     if event.key == pygame.K_v:
                         graphics_enabled = not graphics_enabled
                         if graphics_enabled:
+                            full_sync = True
                             print("\nEnabled graphics")
                         else:
                             print("\nDisabled graphics")
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     exit()
-            robots_alive = list()
-            for r in robots:
-                if (r.alive):
-                    alive += 1
-                    robots_alive.append(r)
-                moved |= r.moved 
+            alive = population.get_alive_amount()
+            moved = population.any_moved()
 
             if moved:
                 stalled_count = 0
@@ -722,41 +838,59 @@ if __name__ == "__main__":
                     break
             
             if (generation % 1 == 0):
-                if (graphics_enabled):
+                if (drawn):
                     update()
-            closest_distance = min([r.get_last_valid_distance() for r in robots if r.get_last_valid_distance()])
-            best_fitness = max([r.get_fitness() for r in robots])
-            #bar.goto(bar.max - closest_distance)
-
-        robots_sorted = sorted(robots, key=lambda r: r.get_fitness(), reverse=True)
+            #bar.goto(bar.max - population.get_closest_distance())
+
+        #individuals fitness, the mean over their starts
+        fitness = population.get_individual_fitness()
+        fitness_distances = population.aggregate(population.get_fitness_distances())
+        fitness_sensors = population.aggregate(population.get_fitness_sensors())
+        individuals_sorted = np.argsort(-fitness, kind="stable")
+        closest_distance = population.get_closest_distance()
+        best_fitness = population.get_best_fitness()
         
+        if population.trace is not None:
+            os.makedirs(os.path.dirname(trace_file), exist_ok=True)
+            best_robots = individuals_sorted[:5, None] * n_starts + np.arange(n_starts)
+            population.trace.save(trace_file, robot_ids=best_robots.reshape(-1))
+
+        if export_policy and not key_control:
+            os.makedirs(os.path.dirname(policy_file), exist_ok=True)
+            policy.save(policy_file, neurals[individuals_sorted[0]], population)
+
         print("")
-        for r in robots_sorted[:5]:
-            print ("{:.2f}%\t{:.2f}%\t{:.2f}%\t{}".format(100*r.get_fitness(), 100*r.get_fitness_distances(), 100*r.get_fitness_sensors(), r.id))
+        for i in individuals_sorted[:5]:
+            print ("{:.2f}%\t{:.2f}%\t{:.2f}%\t{}".format(100*fitness[i], 100*fitness_distances[i], 100*fitness_sensors[i], robots[i * n_starts].id))
 
 
         print ("#"*40)
         print ("\nEnded generation {} after {} steps".format(generation, step))
-        print ("Best robot got to distance {} and fitness {:.2f}%".format(closest_distance, 100*best_fitness))
+        if culling is not None:
+            print ("Culled {} robots that could not be kept".format(culling.culled))
+        print ("Best robot from the start got to distance {}, best individual fitness {:.2f}%".format(closest_distance, 100*best_fitness))
         generation_scores.append([closest_distance, best_fitness])
         print ("#"*40)
         generation += 1
+
+        #only robots from the track start point count, the other starts are closer to the end
+        if level > 0 and np.any(population.last_valid_distance[::n_starts] == Track.END_VALUE):
+            print ("A robot reached the end, promoting population to track level {}".format(level - 1))
+            level_generations = generations_per_level
         
         # input("press enter to continue")
         
 
         #get robots gains and fitness value to run genetic algorithm
         results = list()
-        for r in robots:
-            gains = r.control_unit.get_gains()
-            fitness = r.get_fitness()
+        for i, n in enumerate(neurals):
+            gains = n.get_gains()
             
-            robot_result = {"gains":gains, "fitness":fitness, "id":r.id}
+            robot_result = {"gains":gains, "fitness":fitness[i], "id":robots[i * n_starts].id}
             results.append(robot_result)
 
         g = Genetic(results)
-        new_gains = g.evolve(keep_percent=0.20)
+        new_gains = g.evolve(keep_percent=keep_percent)
         
             
-        for i, n in enumerate(neurals):
-            n.set_gains(new_gains[i]["gains"])
+        genomes[:] = [result["gains"] for result in new_gains]
@@ -88,8 +88,9 @@ class Genetic ():
         
 #        print ("Crossing between {} and {}".format(split_start, split_end))
                 
-        gains_1 = in_1[:split_start] + in_2[split_start:split_end] + in_1[split_end:]
-        gains_2 = in_2[:split_start] + in_1[split_start:split_end] + in_2[split_end:]
+        #gains may be lists or arrays, concatenate instead of adding them
+        gains_1 = np.concatenate((in_1[:split_start], in_2[split_start:split_end], in_1[split_end:]))
+        gains_2 = np.concatenate((in_2[:split_start], in_1[split_start:split_end], in_2[split_end:]))
         out_1 = {"gains":gains_1, "id":"{}_{}".format(id_1, id_2)}
         out_2 = {"gains":gains_2, "id":"{}_{}".format(id_2, id_1)}
         return out_1, out_2
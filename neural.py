@@ -7,6 +7,31 @@ def random_gain ():
 #    return np.random.rand()*2 - 1
     return np.random.normal()
 
+#activations work on whole arrays of values, and keep their dtype
+def relu (values):
+    return np.maximum(values, 0)
+
+def tanh (values):
+    return np.tanh(values)
+
+def sigmoid (values):
+    #the same as 1/(1 + exp(-x)), without overflowing for large values
+    return 0.5 * (1 + np.tanh(values / 2))
+
+def arctan (values):
+    #scaled to (-0.25, 0.25), the squashing robots apply to their controls
+    return np.arctan(values) / (np.pi * 2)
+
+def relu_arctan (values):
+    #rectified then squashed, controls in [0, 0.25) as with a ReLU network
+    #whose outputs go through the robots squashing
+    return arctan(relu(values))
+
+ACTIVATIONS = {"relu": relu, "tanh": tanh, "sigmoid": sigmoid, "arctan": arctan, "relu_arctan": relu_arctan}
+
+#activations that already squash the controls, robots must not squash them again
+SQUASHING_ACTIVATIONS = ("arctan", "relu_arctan")
+
 class neuron :
     def __init__(self, n_inputs, gains):
         #count bias value as a required gain value
@@ -14,7 +39,11 @@ class neuron :
         if self.required_gains != len(gains):
             raise Exception ("Incorrect amount of gain values provided. {}!={}".format(self.required_gains,len(gains)))
         self.n_inputs = n_inputs
-        self.gains = list(gains)
+        #a layer passes a row of its gains matrix, the neuron then works on it in place
+        if isinstance(gains, np.ndarray):
+            self.gains = gains
+        else:
+            self.gains = np.array(gains, dtype=float)
         self.out_func = self.default_out_func
 
         # print(gains)
@@ -26,30 +55,29 @@ class neuron :
     def evaluate (self, inputs):
         if len(inputs) < self.n_inputs:
             raise Exception ("Incorrect amount of inputs provided. {}!={}".format(self.n_inputs,len(inputs)))
-        sum = 0
-        for i in range(self.n_inputs):
-            sum += self.gains[i] * inputs[i]
         #sum the bias
-        sum += self.gains[-1]
-        # print ("neuron result:", sum)
-        return self.out_func(sum)
+        value = np.dot(self.gains[:-1], np.asarray(inputs[:self.n_inputs], dtype=float)) + self.gains[-1]
+        # print ("neuron result:", value)
+        return self.out_func(value)
 
     def get_gains (self):
-        return self.gains
-
-    def set_gains (self,new_gains):
-        self.gains = list(new_gains[:self.required_gains])
-        # print (self.gains)
-        return list(new_gains[self.required_gains:])
+        return self.gains.copy()
 
 class layer:
-    def __init__(self, n_inputs, n_neurons, gains=None):
+    def __init__(self, n_inputs, n_neurons, gains=None, buffer=None, activation="relu", dtype=np.float64):
+        """With `buffer`, a float array of required_gains values, the layer keeps
+        its gains there instead of in an array of its own. `activation` is a
+        name from ACTIVATIONS"""
+        if activation not in ACTIVATIONS:
+            raise Exception ("Unknown activation {}. Use one of {}".format(activation, list(ACTIVATIONS)))
+        self.activation = activation
+        self.out_func = ACTIVATIONS[activation]
         #add an additional required gain to act as bias on each neuron
         self.required_gains = n_neurons * (n_inputs + 1)
         self.n_neurons = n_neurons
         self.n_inputs = n_inputs
         #print ("Create a layer with {} inputs and {} outputs".format (self.n_inputs, self.n_neurons))
-        if gains == None:
+        if gains is None:
             gains = list()
             for g in range(self.required_gains):
                 #gains.append(np.random.normal()) 
@@ -58,42 +86,59 @@ class layer:
         else:
             if len(gains) < self.required_gains:
                 raise Exception ("Incorrect amount of gain values provided. {}!={}".format(len(gains),self.required_gains))
-        self.gains = list(gains)
+
+        if buffer is None:
+            buffer = np.empty(self.required_gains, dtype=dtype)
+        buffer[:] = gains[:self.required_gains]
+        #one row per neuron with its input weights followed by its bias, the same
+        #order as the flat gains list
+        self.matrix = buffer.reshape(n_neurons, n_inputs + 1)
+        self.weights = self.matrix[:, :-1]
+        self.bias = self.matrix[:, -1]
         self.neurons = list()
         for i in range(self.n_neurons):
-            self.neurons.append(neuron(self.n_inputs, gains[i*(self.n_inputs+1):(i+1)*(self.n_inputs+1)]))
+            self.neurons.append(neuron(self.n_inputs, self.matrix[i]))
+            self.neurons[i].out_func = self.out_func
 
     def evaluate (self, inputs):
-        out = list()
-        for n in self.neurons:
-            out.append(n.evaluate(inputs))
-        return out
+        """Outputs of every neuron for an array of `n_inputs` values"""
+        values = self.weights.dot(inputs)
+        values += self.bias
+        return self.out_func(values)
 
     def set_gains (self, new_gains):
-        for n in self.neurons:
-            new_gains = n.set_gains(new_gains)
-        return new_gains
+        self.matrix.reshape(-1)[:] = new_gains[:self.required_gains]
+        return new_gains[self.required_gains:]
 
     def get_gains (self):
-        gains = list()
-        for n in self.neurons:
-            gains += n.get_gains()
-        self.gains = gains
-        return gains
+        return self.matrix.reshape(-1).copy()
 
 class network:
-    def __init__ (self, n_inputs, layers_setup, gains=None):
+    """All the gains live in one contiguous float array, `buffer`, in the flat
+    gains order. Layers and neurons only hold views into it, so reading or
+    writing a genome is a single copy.
+
+    `activations` names the activation of each layer, ReLU for all of them by
+    default. With dtype=np.float32 gains and values are kept in float32"""
+    def __init__ (self, n_inputs, layers_setup, gains=None, buffer=None, activations=None, dtype=np.float64):
         self.n_inputs = n_inputs
         self.layers_setup = layers_setup
         self.n_layers = len(layers_setup)
-        self.gains = gains
-        self.required_gains = 0
-        inputs = n_inputs
-        for l in layers_setup:
-            self.required_gains += (inputs + 1) * l
-            inputs = int(l)
+        self.required_gains = self.count_gains(n_inputs, layers_setup)
+        if activations is None:
+            activations = ["relu"] * self.n_layers
+        if len(activations) != self.n_layers:
+            raise Exception ("Incorrect amount of activations provided. {}!={}".format(len(activations), self.n_layers))
+        self.activations = list(activations)
         #print ("{} gains required for this network".format(self.required_gains))
 
+        #a given buffer, such as a row of a population genomes array, is used in place
+        if buffer is None:
+            buffer = np.empty(self.required_gains, dtype=dtype)
+        elif buffer.shape != (self.required_gains,):
+            raise Exception ("Incorrect gains buffer size. {}!={}".format(buffer.shape, self.required_gains))
+        self.buffer = buffer
+
         self.layers = list()
 
         gains_used = 0
@@ -101,39 +146,117 @@ class network:
 
         for i in range(self.n_layers):
             outputs = self.layers_setup[i]
-            if self.gains==None:
-                gains = None
+            layer_gains = (inputs + 1)*outputs
+            if gains is None:
+                layer_values = None
             else:
-                gains = self.gains[gains_used:gains_used + (inputs + 1)*outputs]
-                gains_used += (inputs + 1)*outputs
-            self.layers.append(layer(inputs, outputs, gains=gains))
+                layer_values = gains[gains_used:gains_used + layer_gains]
+            self.layers.append(layer(inputs, outputs, gains=layer_values,
+                                     buffer=self.buffer[gains_used:gains_used + layer_gains],
+                                     activation=self.activations[i]))
+            gains_used += layer_gains
             inputs = outputs
 
+    @staticmethod
+    def count_gains (n_inputs, layers_setup):
+        required_gains = 0
+        inputs = n_inputs
+        for l in layers_setup:
+            required_gains += (inputs + 1) * l
+            inputs = int(l)
+        return required_gains
+
     def evaluate (self, inputs):
-        in_values = list(inputs)
+        if len(inputs) < self.n_inputs:
+            raise Exception ("Incorrect amount of inputs provided. {}!={}".format(self.n_inputs,len(inputs)))
+        values = np.array(inputs[:self.n_inputs], dtype=self.buffer.dtype)
 
-        for i in range (self.n_layers):
-            out = self.layers[i].evaluate(in_values)
-            in_values = list(out)
-        return out
+        for l in self.layers:
+            values = l.evaluate(values)
+        return values.tolist()
 
     def set_gains (self, new_gains):
-        if (new_gains == None):
+        if (new_gains is None):
             new_gains = list()
             for i in range(self.required_gains):
                 new_gains.append(random_gain())
-        for l in self.layers:
-            new_gains = list(l.set_gains(new_gains))
-        return new_gains
+        self.buffer[:] = new_gains[:self.required_gains]
+        return new_gains[self.required_gains:]
 
     def get_gains (self):
-        #print ("set network gains")
-        gains = list()
-        for l in self.layers:
-            gains += l.get_gains()
-        self.gains = gains
-        return gains
+        """A copy of the gains buffer, it is not changed by later set_gains calls"""
+        return self.buffer.copy()
     
+def create_population (n_networks, n_inputs, layers_setup, activations=None, dtype=np.float64):
+    """Creates `n_networks` random networks whose gains are the rows of one
+    (n_networks, required_gains) genomes array. Returns (genomes, networks)"""
+    genomes = np.empty((n_networks, network.count_gains(n_inputs, layers_setup)), dtype=dtype)
+    networks = list()
+    for i in range(n_networks):
+        networks.append(network(n_inputs, layers_setup, buffer=genomes[i], activations=activations))
+    return genomes, networks
+
+class network_batch:
+    """Evaluates many networks with the same n_inputs and layers_setup at once.
+    The weights of each layer are stacked into a (networks, outputs, inputs)
+    array, so a whole population is a few NumPy calls per layer.
+
+    With `genomes`, the array from create_population holding the gains of
+    `networks`, the stacks are views into it and always up to date. Otherwise
+    they are copies, call refresh after changing the gains of the networks"""
+    def __init__ (self, networks, genomes=None):
+        self.networks = list(networks)
+        self.genomes = genomes
+        self.n_inputs = self.networks[0].n_inputs
+        self.layers_setup = tuple(self.networks[0].layers_setup)
+        self.activations = self.networks[0].activations
+        for n in self.networks:
+            if n.n_inputs != self.n_inputs or tuple(n.layers_setup) != self.layers_setup or \
+                n.activations != self.activations:
+                raise Exception ("Networks in a batch need the same setup. {} {} {}!={} {} {}".format(
+                    n.n_inputs, tuple(n.layers_setup), n.activations,
+                    self.n_inputs, self.layers_setup, self.activations))
+        self.weights = list()
+        self.bias = list()
+        if genomes is None:
+            self.refresh()
+            return
+        if genomes.shape != (len(self.networks), self.networks[0].required_gains):
+            raise Exception ("Genomes array does not fit the networks. {}".format(genomes.shape))
+
+        gains_used = 0
+        for l in self.networks[0].layers:
+            matrices = genomes[:, gains_used:gains_used + l.required_gains].reshape(
+                len(genomes), l.n_neurons, l.n_inputs + 1)
+            self.weights.append(matrices[:, :, :-1])
+            self.bias.append(matrices[:, :, -1])
+            gains_used += l.required_gains
+
+    def refresh (self):
+        if self.genomes is not None:
+            return
+        self.weights = list()
+        self.bias = list()
+        for i in range(len(self.layers_setup)):
+            self.weights.append(np.stack([n.layers[i].weights for n in self.networks]))
+            self.bias.append(np.stack([n.layers[i].bias for n in self.networks]))
+
+    def evaluate (self, inputs, owners=None):
+        """Outputs for a (rows, n_inputs) array of inputs, one row per evaluation.
+        Row r is evaluated by network owners[r], row i by network i by default"""
+        values = np.asarray(inputs, dtype=self.weights[0].dtype)[:, :self.n_inputs]
+        layers = self.networks[0].layers
+        for i in range(len(self.layers_setup)):
+            weights = self.weights[i]
+            bias = self.bias[i]
+            if owners is not None:
+                weights = weights[owners]
+                bias = bias[owners]
+            values = np.einsum('rij,rj->ri', weights, values)
+            values += bias
+            values = layers[i].out_func(values)
+        return values
+
 def mutation (gains):
     gains_len = len(gains)
     gains_to_mutate = int(np.random.rand() * gains_len * 1) 
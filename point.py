@@ -16,10 +16,31 @@ class Point:
     """The first dimension value in a numpy array is in Y direction
     when array is printed
     \narray position [0][0] is top left member"""
+    #no __dict__, points are created and updated many times per step
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
 
+    def set(self, x, y):
+        """Moves the point in place"""
+        self.x = x
+        self.y = y
+        return self
+
+    def set_to(self, other):
+        """Copies `other` coordinates into this point"""
+        self.x = other.x
+        self.y = other.y
+        return self
+
+    def iadd(self, dx, dy):
+        """Adds an offset in place, the same as p = p + Point(dx, dy)"""
+        self.x = self.x + dx
+        self.y = self.y + dy
+        return self
+
     def __repr__(self):
         return str(self)
 
@@ -51,7 +72,7 @@ class Point:
         return (self.x, self.y)
 
     def get_int_xy(self):
-        return (self.int_x(), self.int_y())
+        return (int(round(self.x)), int(round(self.y)))
 
     def int_x(self):
         return int(round(self.x))
@@ -67,4 +88,4 @@ class Point:
 
 
 class point(Point):
-    pass
+    __slots__ = ()
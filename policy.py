@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Trained policies saved apart from the training code
+
+save writes a neural.network together with the robot setup it was trained
+with to a .npz file. load reads it back as a Policy, which evaluates the
+network with a few NumPy calls per layer. Only NumPy is imported (neural.py
+needs nothing else), so evaluation jobs and deployed robots start without
+pygame, PIL or progress.
+
+Policies are saved as .npz files:
+  n_inputs         amount of network inputs
+  layers_setup     neurons of each layer
+  activations      activation name of each layer, from neural.ACTIVATIONS
+  gains            flat gains of the network, in its dtype
+  sensors          n_sensors, sensors_pitch, sensors_dist and max_range
+  sensor_mode      "points" or "range"
+  sensor_headings  amount of precomputed sensor headings, 0 when exact
+  heading_input    True when the heading error is the last input
+  squash_controls  True when the outputs still go through arctan(x)/(2*pi)
+  kinematics       acc, max_speed and turn_rate of the robots
+"""
+
+import numpy as np
+
+from neural import ACTIVATIONS
+
+
+def save(filename, net, robot):
+    """Saves network `net` with the setup of `robot`, a RobotPopulation or a
+    RobotCore running it"""
+    np.savez(filename, n_inputs=net.n_inputs, layers_setup=np.array(net.layers_setup, dtype=np.int64),
+             activations=np.array(net.activations), gains=net.buffer,
+             sensors=np.array([robot.n_sensors, robot.sensors_pitch, robot.sensors_dist, robot.max_range], dtype=float),
+             sensor_mode=robot.sensor_mode, sensor_headings=robot.sensor_headings or 0,
+             heading_input=robot.heading_input, squash_controls=robot.squash_controls,
+             kinematics=np.array([robot.acc, robot.max_speed, robot.turn_rate], dtype=float))
+
+
+def load(filename):
+    with np.load(filename) as data:
+        return Policy({key: data[key] for key in data.files})
+
+
+class Policy:
+    def __init__(self, data):
+        self.n_inputs = int(data["n_inputs"])
+        self.layers_setup = tuple(data["layers_setup"].tolist())
+        self.activations = [str(a) for a in data["activations"]]
+        self.gains = data["gains"]
+        self.n_sensors, self.sensors_pitch, self.sensors_dist, self.max_range = data["sensors"].tolist()
+        self.n_sensors = int(self.n_sensors)
+        self.sensor_mode = str(data["sensor_mode"])
+        self.sensor_headings = int(data["sensor_headings"]) or None
+        self.heading_input = bool(data["heading_input"])
+        self.squash_controls = bool(data["squash_controls"])
+        self.acc, self.max_speed, self.turn_rate = data["kinematics"].tolist()
+
+        for activation in self.activations:
+            if activation not in ACTIVATIONS:
+                raise Exception ("Unknown activation {}. Use one of {}".format(activation, list(ACTIVATIONS)))
+
+        #same layout as neural.layer, one row per neuron with its weights followed by its bias
+        self.weights = list()
+        self.bias = list()
+        self.out_funcs = [ACTIVATIONS[a] for a in self.activations]
+        inputs = self.n_inputs
+        gains_used = 0
+        for outputs in self.layers_setup:
+            layer_gains = outputs * (inputs + 1)
+            matrix = self.gains[gains_used:gains_used + layer_gains].reshape(outputs, inputs + 1)
+            self.weights.append(matrix[:, :-1].T)
+            self.bias.append(matrix[:, -1])
+            gains_used += layer_gains
+            inputs = outputs
+        if gains_used != len(self.gains):
+            raise Exception ("Incorrect amount of gain values provided. {}!={}".format(len(self.gains), gains_used))
+
+    def evaluate(self, inputs):
+        """Controls [acc, brake, left, right] for one row of inputs, or one row of
+        controls per row of a (rows, n_inputs) array. The outputs are squashed
+        like RobotPopulation.update does, so they are the values robots move with"""
+        values = np.asarray(inputs, dtype=self.gains.dtype)[..., :self.n_inputs]
+        for weights, bias, out_func in zip(self.weights, self.bias, self.out_funcs):
+            values = out_func(values @ weights + bias)
+        if self.squash_controls:
+            values = ACTIVATIONS["arctan"](values)
+        return values
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Population of robots simulated as arrays
+
+RobotPopulation keeps the state of every robot (positions, headings, speeds
+and the step counters used to decide when a robot dies) in NumPy arrays and
+advances the whole population at once. One step follows robot_core.RobotCore.update
+for each robot, so both produce the same runs given the same controls.
+
+Each individual (one control function) can drive `n_starts` robots, each one
+starting from a different pose. They are simulated together and the fitness
+of an individual is the mean fitness of its robots. The robots of individual
+i are the indexes i * n_starts to (i + 1) * n_starts - 1.
+"""
+
+import numpy as np
+
+from coordinates import Coordinates as coord
+import track_cache
+
+
+def squash(controls):
+    """Maps raw controls to (-0.25, 0.25), as networks ending with the arctan activation do"""
+    return np.arctan(controls) / (np.pi * 2)
+
+
+def move(speed, heading, pos_x, pos_y, controls, acc, max_speed, turn_rate, track_scale=1):
+    """Robot kinematics, applies one squashed [acc, brake, left, right] row of
+    `controls` per robot and returns the new (speed, heading, pos_x, pos_y) arrays"""
+    acc_in, brake, left, right = controls.T
+
+    #a zero control leaves speed and heading untouched, as the skipped branches of Robot.update
+    speed = np.minimum(speed + acc * acc_in, max_speed)
+    speed = np.maximum(speed - acc * brake, (-1)*max_speed)
+    heading = np.remainder(heading + turn_rate * left, 2*np.pi)
+    heading = np.remainder(heading - turn_rate * right, 2*np.pi)
+
+    delta_x, delta_y = coord.polar2xy(speed * track_scale, heading)
+    #inverted sign due to inverted Y axis direction
+    return speed, heading, pos_x + delta_x, pos_y + (-delta_y)
+
+
+def get_distance_jump(path, distances, radius):
+    """Largest amount by which the distances to finish of two reachable cells at
+    most `radius` cells apart differ by more than ceil(sqrt(2) * r) + 2, r being
+    how far apart they are. It is positive when a robot can land past a wall
+    thinner than `radius` and inf when cells on track are not reachable, as a
+    robot can stay on them for any amount of steps"""
+    if np.any((path != track_cache.OFF_TRACK) & (distances < track_cache.END_VALUE)):
+        return np.inf
+    valid_y, valid_x = np.nonzero(distances >= track_cache.END_VALUE)
+    valid = distances[valid_y, valid_x].astype(np.int64)
+    size_y, size_x = distances.shape
+    reach = int(np.ceil(radius))
+    jump = -np.inf
+    #each pair of cells is checked once, from the cell with the smallest y or x
+    for dy in range(reach + 1):
+        for dx in range(-reach, reach + 1):
+            length = np.hypot(dx, dy)
+            if (dy == 0 and dx <= 0) or length > radius:
+                continue
+            x = valid_x + dx
+            y = valid_y + dy
+            inside = (x >= 0) & (x < size_x) & (y < size_y)
+            other = distances[y[inside], x[inside]].astype(np.int64)
+            reachable = other >= track_cache.END_VALUE
+            if np.any(reachable):
+                difference = np.abs(other[reachable] - valid[inside][reachable]).max()
+                jump = max(jump, difference - (np.ceil(np.sqrt(2) * length) + 2))
+    return jump
+
+
+class RobotPopulation:
+    """heading =      0 -> car aligned with  +X
+      heading =   pi/2 -> car aligned with  +Y
+      heading =     pi -> car aligned with  -X
+      heading = 3*pi/2 -> car aligned with  -Y
+
+    sensor IDs example with 8 sensors:
+     x x x x|x x x x
+     0 1 2 3 4 5 6 7
+    """
+    SENSOR_POINTS = "points"
+    SENSOR_RANGE = "range"
+
+    OFF_TRACK = track_cache.OFF_TRACK
+    END_VALUE = track_cache.END_VALUE
+
+    def __init__(self, n_individuals, n_sensors, sensors_pitch=10, sensors_dist=100, heading=np.pi,
+                 sensor_headings=None, n_starts=1):
+        self.n_individuals = n_individuals
+        self.n_starts = n_starts
+        self.n_robots = n_robots = n_individuals * n_starts
+        #individual driving each robot
+        self.owners = np.arange(n_robots) // n_starts
+
+        #moving parameters
+        self.max_speed = 4
+        self.acc = 1
+        self.turn_rate = np.deg2rad(5)
+
+        #robot config parameters
+        self.n_sensors = n_sensors
+        self.sensors_dist = sensors_dist
+        self.sensors_pitch = sensors_pitch
+        self.calculate_sensor_geometry(sensor_headings)
+
+        self.max_off_track = 6
+        self.max_without_moving = 80
+        self.max_without_improving = 80
+
+        self.track_scale = 1
+        self.sensor_mode = self.SENSOR_POINTS
+        self.max_range = sensors_dist * 2
+        self.heading_input = False
+        self.control_funcs = None
+        self.control_batch = None
+        self.squash_controls = True
+        self.trace = None
+
+        #state of each robot
+        self.pos_x = np.zeros(n_robots)
+        self.pos_y = np.zeros(n_robots)
+        self.heading = np.full(n_robots, float(heading))
+        self.speed = np.zeros(n_robots)
+        self.alive = np.ones(n_robots, dtype=bool)
+        self.moved = np.zeros(n_robots, dtype=bool)
+        self.distance_to_finish = np.zeros(n_robots)
+        self.last_distance_to_finish = np.zeros(n_robots)
+        self.last_valid_distance = np.full(n_robots, -1.0)
+        #NaN until the first distance is read after a reset
+        self.best_distance = np.full(n_robots, np.nan)
+        self.improved_this_step = np.zeros(n_robots, dtype=bool)
+        self.steps_without_moving = np.zeros(n_robots, dtype=np.int64)
+        self.steps_without_improving = np.zeros(n_robots, dtype=np.int64)
+        self.steps_off_track = np.zeros(n_robots, dtype=np.int64)
+        self.steps_sensors_off_track = np.zeros(n_robots, dtype=np.int64)
+        self.steps_run = np.zeros(n_robots, dtype=np.int64)
+        self.update_count = np.zeros(n_robots, dtype=np.int64)
+        self.last_sensor_reads = np.zeros((n_robots, n_sensors))
+
+        #indexes of the robots still alive, dead robots are dropped from it as they die
+        self.active = np.arange(n_robots)
+        #robots advanced by the last update, including the ones that died on it
+        self.stepped = self.active
+        #get_distance_jump of each track the fitness was bounded on
+        self.distance_jumps = dict()
+
+    def set_track(self, track):
+        """Runs the population over `track`, which may be a coarse level of a track pyramid"""
+        self.track = track
+        self.max_distance = track.max_distance
+        self.track_scale = track.scale
+
+    def set_sensor_mode(self, mode, max_range=None):
+        self.sensor_mode = mode
+        if max_range is not None:
+            self.max_range = max_range
+
+    def set_heading_input(self, enabled):
+        self.heading_input = enabled
+
+    def set_control_funcs(self, control_funcs):
+        """One function per individual, called with the inputs of each of its
+        robots and returning [acc, brake, left, right]"""
+        self.control_funcs = list(control_funcs)
+
+    def set_control_batch(self, control_batch):
+        """Replaces the control functions with one call for all the alive robots.
+        `control_batch(inputs, owners)` gets the inputs with one row per robot and
+        the individual of each robot, and returns one [acc, brake, left, right] row
+        per robot. neural.network_batch.evaluate fits it"""
+        self.control_batch = control_batch
+
+    def set_squash_controls(self, enabled):
+        """Controls are squashed before moving the robots. Disable it when the
+        networks already end with the arctan activation"""
+        self.squash_controls = enabled
+
+    def set_trace(self, trace):
+        """Records the controls of every step into `trace`, a control_trace.ControlTrace"""
+        self.trace = trace
+
+    def get_inputs_amount(self):
+        return 1 + self.n_sensors + (1 if self.heading_input else 0)
+
+    def reset(self, start_point, start_heading_rad, start_poses=None):
+        """Places every robot at `start_point`. With `start_poses`, a list of
+        n_starts (x, y, heading) tuples, each individual starts a robot from each pose"""
+        self.alive[:] = True
+        if start_poses is None:
+            self.pos_x[:] = start_point.x
+            self.pos_y[:] = start_point.y
+            self.heading[:] = np.remainder(start_heading_rad, 2*np.pi)
+        else:
+            start_x, start_y, start_heading = np.array(start_poses, dtype=float).reshape(self.n_starts, 3).T
+            self.pos_x[:] = np.tile(start_x, self.n_individuals)
+            self.pos_y[:] = np.tile(start_y, self.n_individuals)
+            self.heading[:] = np.tile(np.remainder(start_heading, 2*np.pi), self.n_individuals)
+        self.speed[:] = 0
+        self.moved[:] = False
+        self.steps_without_moving[:] = 0
+        self.steps_without_improving[:] = 0
+        self.steps_off_track[:] = 0
+        self.best_distance[:] = np.nan
+        self.improved_this_step[:] = False
+        self.last_sensor_reads[:] = 0
+        self.steps_sensors_off_track[:] = 0
+        self.steps_run[:] = 0
+        self.active = np.arange(self.n_robots)
+        self.stepped = self.active
+        if self.trace is not None:
+            self.trace.start(self)
+
+    def calculate_sensor_geometry(self, sensor_headings=None):
+        """Sensor layout in polar coordinates relative to the robot, as in
+        robot_core.RobotCore.calculate_sensor_geometry"""
+        sensor_x = self.sensors_dist
+        sensor_y = ((self.n_sensors - 1)/2 - np.arange(self.n_sensors)) * self.sensors_pitch
+        self.sensor_r, self.sensor_theta = coord.xy2polar(sensor_x, sensor_y)
+
+        self.sensor_headings = sensor_headings
+        if sensor_headings:
+            headings = np.arange(sensor_headings) * (2*np.pi / sensor_headings)
+            table_x, table_y = coord.polar2xy(self.sensor_r, self.sensor_theta + headings[:, None])
+            self.sensor_table = (table_x, -table_y)
+
+    def get_sensor_offsets(self, idx):
+        """Sensor positions relative to each robot in `idx`, as (x, y) arrays of shape (robots, sensors)"""
+        if self.sensor_headings:
+            k = np.rint(self.heading[idx] * self.sensor_headings / (2*np.pi)).astype(np.intp) % self.sensor_headings
+            return self.sensor_table[0][k] * self.track_scale, self.sensor_table[1][k] * self.track_scale
+
+        new_x, new_y = coord.polar2xy(self.sensor_r * self.track_scale, self.sensor_theta + self.heading[idx, None])
+        #inverted sign due to inverted Y axis direction
+        return new_x, -new_y
+
+    def get_sensor_positions(self, idx):
+        offset_x, offset_y = self.get_sensor_offsets(idx)
+        return self.pos_x[idx, None] + offset_x, self.pos_y[idx, None] + offset_y
+
+    def cast_rays(self, idx):
+        """Sphere traces the wall distance field from each robot towards its sensors.
+        Returns the distances to the wall divided by `max_range`, at most 1"""
+        dx, dy = coord.polar2xy(1, self.sensor_theta + self.heading[idx, None])
+        dy = -dy
+
+        max_range = self.max_range * self.track_scale
+        start_x = np.broadcast_to(self.pos_x[idx, None], dx.shape)
+        start_y = np.broadcast_to(self.pos_y[idx, None], dx.shape)
+        dist = np.zeros(dx.shape)
+        tracing = dist < max_range
+        while np.any(tracing):
+            wall_dist = self.track.get_wall_distance_many(start_x[tracing] + dist[tracing] * dx[tracing],
+                                                          start_y[tracing] + dist[tracing] * dy[tracing])
+            hit = wall_dist <= 0
+            dist[tracing] += np.where(hit, 0, np.maximum(wall_dist - 1, 1))
+            tracing[tracing] = ~hit
+            tracing &= dist < max_range
+        return np.minimum(dist, max_range) / max_range
+
+    def get_heading_errors(self, idx):
+        direction = self.track.get_direction_many(self.pos_x[idx], self.pos_y[idx])
+        error = (np.remainder(direction - self.heading[idx] + np.pi, 2*np.pi) - np.pi) / np.pi
+        return np.where(np.isnan(direction), 0, error)
+
+    def get_inputs(self, idx):
+        """Inputs of the robots in `idx`, one row per robot: speed, sensor reads
+        and the heading error when enabled. Updates last_sensor_reads"""
+        columns = [self.speed[idx, None]]
+        if self.sensor_mode == self.SENSOR_RANGE:
+            reads = self.cast_rays(idx)
+            #a zero range means the sensor ray starts off track
+            self.last_sensor_reads[idx] = np.where(reads > 0, reads, self.OFF_TRACK)
+        else:
+            xs, ys = self.get_sensor_positions(idx)
+            reads = self.track.get_path_many(xs, ys)
+            self.last_sensor_reads[idx] = reads
+        columns.append(reads)
+        if self.heading_input:
+            columns.append(self.get_heading_errors(idx)[:, None])
+        return np.concatenate(columns, axis=1)
+
+    def get_controls(self, idx, inputs):
+        """Returns an array with one [acc, brake, left, right] row per robot in `idx`"""
+        if self.control_batch is not None:
+            return np.asarray(self.control_batch(inputs, self.owners[idx]), dtype=float)
+        controls = np.zeros((len(idx), 4))
+        for row, i in enumerate(self.owners[idx].tolist()):
+            controls[row] = self.control_funcs[i](list(inputs[row]))
+        return controls
+
+    def update(self):
+        """Advances every alive robot one step. Returns the amount of robots still alive"""
+        idx = self.active
+        self.stepped = idx
+        if len(idx) == 0:
+            return 0
+        self.update_count[idx] += 1
+        self.steps_run[idx] += 1
+
+        controls = self.get_controls(idx, self.get_inputs(idx))
+        if self.squash_controls:
+            controls = squash(controls)
+        if self.trace is not None:
+            self.trace.record(idx, controls)
+        if self.n_sensors > 0:
+            self.steps_sensors_off_track[idx] += ~np.any(self.last_sensor_reads[idx] >= 0, axis=1)
+
+        last_x = self.pos_x[idx]
+        last_y = self.pos_y[idx]
+        speed, heading, pos_x, pos_y = move(self.speed[idx], self.heading[idx], last_x, last_y, controls,
+                                            self.acc, self.max_speed, self.turn_rate, self.track_scale)
+        self.speed[idx] = speed
+        self.heading[idx] = heading
+        self.pos_x[idx] = pos_x
+        self.pos_y[idx] = pos_y
+
+        self.check_alive(idx, pos_x, pos_y)
+        moved = self.alive[idx] & ((pos_x != last_x) | (pos_y != last_y))
+        self.moved[idx] = moved
+        self.steps_without_moving[idx] += ~moved
+        self.calc_new_distances(idx, pos_x, pos_y)
+
+        alive = self.alive[idx]
+        if not np.all(alive):
+            self.active = idx[alive]
+        return len(self.active)
+
+    def kill(self, idx):
+        """Stops the alive robots in `idx`, their fitness is kept as it is now"""
+        idx = np.asarray(idx, dtype=np.intp)
+        self.alive[idx] = False
+        self.moved[idx] = False
+        self.active = self.active[self.alive[self.active]]
+
+    def kill_all(self):
+        self.kill(self.active)
+
+    def get_alive_amount(self):
+        return len(self.active)
+
+    def any_moved(self):
+        """Dead robots never move, only the alive ones are checked"""
+        return bool(np.any(self.moved[self.active]))
+
+    def get_closest_distance(self):
+        """Smallest last valid distance of the robots from the track start point,
+        not counting robots at the end. The other starts are closer to the end and
+        are left out. None if every robot is at the end"""
+        distances = self.last_valid_distance[::self.n_starts]
+        distances = distances[distances != self.END_VALUE]
+        return distances.min() if len(distances) else None
+
+    def get_best_fitness(self):
+        """Best fitness of an individual, the mean over its starts"""
+        return self.get_individual_fitness().max()
+
+    def check_alive(self, idx, pos_x, pos_y):
+        alive = np.ones(len(idx), dtype=bool)
+
+        off_track = self.track.get_path_many(pos_x, pos_y) == self.OFF_TRACK
+        steps_off_track = np.where(off_track, self.steps_off_track[idx] + 1, 0)
+        self.steps_off_track[idx] = steps_off_track
+        alive &= ~(off_track & (steps_off_track >= self.max_off_track))
+
+        improved = self.improved_this_step[idx]
+        steps_without_improving = np.where(improved, 0, self.steps_without_improving[idx] + 1)
+        self.steps_without_improving[idx] = steps_without_improving
+        alive &= ~(~improved & (steps_without_improving > self.max_without_improving))
+
+        alive &= self.steps_without_moving[idx] < self.max_without_moving
+        self.alive[idx] = alive
+
+    def calc_new_distances(self, idx, pos_x, pos_y):
+        alive = self.alive[idx]
+        distance = self.distance_to_finish[idx]
+        new_distance = self.track.get_distance_many(pos_x, pos_y)
+        self.last_distance_to_finish[idx] = np.where(alive, distance, self.last_distance_to_finish[idx])
+        distance = np.where(alive, new_distance, distance)
+        self.distance_to_finish[idx] = distance
+
+        last_valid = np.where(distance >= 0, distance, self.last_valid_distance[idx])
+        self.last_valid_distance[idx] = last_valid
+
+        #store best distance value achieved so far
+        best = self.best_distance[idx]
+        first = np.isnan(best)
+        improved = ~first & (last_valid < best)
+        self.best_distance[idx] = np.where(first | improved, last_valid, best)
+        self.improved_this_step[idx] = np.where(first, self.improved_this_step[idx], improved)
+
+    def get_last_distance_to_finish(self):
+        return np.where(self.alive, self.distance_to_finish, self.last_distance_to_finish)
+
+    def get_fitness_distances(self, idx=slice(None)):
+        return (self.max_distance - self.last_valid_distance[idx]) / self.max_distance
+
+    def get_fitness_sensors(self, idx=slice(None)):
+        return (self.steps_run[idx] - self.steps_sensors_off_track[idx]) / self.steps_run[idx]
+
+    def get_fitness(self, idx=slice(None)):
+        return self.combine_fitness(self.get_fitness_distances(idx), self.get_fitness_sensors(idx))
+
+    def aggregate(self, values):
+        """Mean over the starts of each individual of a per robot array"""
+        return np.asarray(values).reshape(self.n_individuals, self.n_starts).mean(axis=1)
+
+    def get_individual_fitness(self):
+        return self.aggregate(self.get_fitness())
+
+    @staticmethod
+    def combine_fitness(fitness_distances, fitness_sensors):
+        w_dist = 0.9
+        w_sensors = 0.1
+        w_sum = w_dist + w_sensors
+        return (w_dist * fitness_distances + w_sensors*fitness_sensors)/w_sum
+
+    def get_max_travel(self, idx, remaining_steps):
+        """Longest path, in full resolution pixels, each robot in `idx` can drive
+        in `remaining_steps` steps. Speed changes at most acc/2 per step, as acc
+        and brake can both push it the same way, and is capped at max_speed"""
+        speed = np.abs(self.speed[idx])
+        change = self.acc / 2
+        ramp = np.clip(np.floor((self.max_speed - speed) / change), 0, remaining_steps)
+        return ramp * speed + change * ramp * (ramp + 1) / 2 + (remaining_steps - ramp) * self.max_speed
+
+    def has_distance_bounds(self):
+        """True when no robot can land on a cell past a wall, that is when no two
+        reachable cells closer than the longest way a robot drives between two
+        cells on track break the bound of get_fitness_bounds. Checked once per
+        track, tracks without a full distances grid, such as tiled ones, are not
+        checked and have no bounds"""
+        jump = self.distance_jumps.get(self.track)
+        if jump is None:
+            if getattr(self.track, "distances", None) is None:
+                jump = np.inf
+            else:
+                #max_off_track - 1 steps off track and the one landing back, plus the rounding of both ends
+                radius = self.max_off_track * self.max_speed * self.track_scale + np.sqrt(2)
+                jump = get_distance_jump(self.track.path, self.track.distances, radius)
+            self.distance_jumps[self.track] = jump
+        return bool(jump <= 0)
+
+    def get_fitness_bounds(self, idx, remaining_steps):
+        """Lowest and highest fitness the robots in `idx` can still end the
+        generation with if it lasts at most `remaining_steps` more steps.
+
+        Distances to finish are counted in 4-connected cells, so driving r
+        cells along the track changes them by at most ceil(sqrt(2) * r), plus
+        one cell per axis for rounding the positions. Off track robots also
+        count the way driven since their last valid cell.
+
+        A robot can stay off track for max_off_track - 1 steps and land past a
+        thin wall, where the distance may change much more. When the track has
+        cells that close (has_distance_bounds is False) any distance is
+        assumed possible, so no robot can be culled on it"""
+        current = self.last_valid_distance[idx]
+        travel = self.get_max_travel(idx, remaining_steps) + self.steps_off_track[idx] * self.max_speed
+        change = np.ceil(np.sqrt(2) * travel * self.track_scale) + 2
+        #robots without a valid distance yet can still end anywhere
+        unknown = (current < self.END_VALUE) | (not self.has_distance_bounds())
+        low_distance = np.where(unknown, self.END_VALUE, np.maximum(current - change, self.END_VALUE))
+        high_distance = np.where(unknown, self.max_distance, np.minimum(current + change, self.max_distance))
+
+        #sensor fitness is lowest when every remaining step has the sensors off
+        #track and highest when none has
+        on_track = self.steps_run[idx] - self.steps_sensors_off_track[idx]
+        steps = self.steps_run[idx] + remaining_steps
+        low = self.combine_fitness((self.max_distance - high_distance) / self.max_distance, on_track / steps)
+        high = self.combine_fitness((self.max_distance - low_distance) / self.max_distance,
+                                    (on_track + remaining_steps) / steps)
+        return low, high
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Draws the runs stored in a control trace
+
+  python replay.py <trace.npz> [track image] [steps per second]
+
+Trajectories are rebuilt with control_trace.replay, only the kinematics run,
+so training can stay headless and the best robots are watched afterwards.
+"""
+
+import sys
+
+import pygame
+
+import control_trace
+from display import Track, Robot, WHITE, RED
+
+
+def render(trace, track, fps=60):
+    """Draws every robot of `trace` over `track`, leaving the path each one drove"""
+    states = control_trace.replay(trace)
+    n_sensors, sensors_pitch, sensors_dist = trace["sensors"].astype(int).tolist()
+    track_scale = trace["kinematics"][3]
+
+    screen = pygame.display.set_mode([track.size_x, track.size_y])
+    pygame.display.set_caption("IA follow replay")
+    background = track.distances_image.copy()
+
+    robots_list = pygame.sprite.Group()
+    robots = list()
+    for i in range(states.shape[1]):
+        r = Robot(RED if i == 0 else WHITE, n_sensors, sensors_pitch, sensors_dist)
+        r.track_scale = track_scale
+        robots.append(r)
+        robots_list.add(r)
+
+    clock = pygame.time.Clock()
+    last_screen_pos = [None] * len(robots)
+    for step in range(len(states)):
+        for i, r in enumerate(robots):
+            speed, heading, x, y = states[step, i]
+            r.heading = heading
+            r.pos.set(x, y)
+            r.refresh_image()
+            screen_pos = r.get_screen_pos()
+            if last_screen_pos[i] is not None and screen_pos != last_screen_pos[i]:
+                pygame.draw.line(background, RED if i == 0 else WHITE, last_screen_pos[i], screen_pos)
+            last_screen_pos[i] = screen_pos
+
+        screen.blit(background, (0, 0))
+        robots_list.draw(screen)
+        pygame.display.flip()
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+        clock.tick(fps)
+
+    #keep the last frame until the window is closed
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+        clock.tick(10)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print ("usage: {} <trace.npz> [track image] [steps per second]".format(sys.argv[0]))
+        sys.exit(1)
+
+    trace = control_trace.load(sys.argv[1])
+    filename = sys.argv[2] if len(sys.argv) > 2 else 'tracks/track_1000x1000_fast_training.png'
+    fps = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+
+    pygame.init()
+    t = Track.from_file(filename, (1000,1000), cache_dir='tracks/cache')
+    print ("Replaying {} steps of robots {}".format(len(trace["controls"]), trace["robot_ids"].tolist()))
+    render(trace, t, fps)
+    pygame.quit()
@@ -8,21 +8,8 @@ Created on Sat Oct 26 18:50:52 2019
 
 import numpy as np
 from point import *
+from coordinates import polar2xy, rotate
 
-def polar2z(r,theta):
-    return r * np.exp( 1j * theta )
-
-def z2polar(z):
-    return ( abs(z), np.angle(z) )
-
-def xy2polar(x,y):
-    return z2polar(x + y * 1j)
-
-def z2xy(z):
-    return (np.real(z), np.imag(z))
-
-def polar2xy(r,theta):
-    return z2xy(polar2z(r,theta))
 
 
 ##             ^ +y
@@ -79,23 +66,22 @@ class robot:
         sensor_x = self.sensors_dist
         sensor_y = ((self.n_sensors - 1)/2 - sensor_id) * self.sensors_pitch
 
-        #transform into polar coordinates
-        z = (sensor_x + sensor_y * 1j)
-        r,theta = z2polar(z)
-
-        #sum heading to theta to calculate sensor position in reference to robot position
-        new_theta = theta + self.heading
-        new_z = polar2z(r,new_theta)
+        #rotate by heading to calculate sensor position in reference to robot position
+        new_x, new_y = rotate(sensor_x, sensor_y, self.heading)
         #calculate final position in reference to track's origin
-        final_sensor_x = round(np.real(new_z) + self.position.x)
-        final_sensor_y = round(np.imag(new_z) + self.position.y)
+        final_sensor_x = round(new_x + self.position.x)
+        final_sensor_y = round(new_y + self.position.y)
 
         return point(int(final_sensor_x), int(final_sensor_y))
 
     def calculate_sensor_positions (self):
-        self.sensor_positions = list()
-        for i in range (self.n_sensors):
-            self.sensor_positions.append(self.get_sensor_position(i))
+        #rotate every sensor at once
+        sensor_x = self.sensors_dist
+        sensor_y = ((self.n_sensors - 1)/2 - np.arange(self.n_sensors)) * self.sensors_pitch
+        new_x, new_y = rotate(sensor_x, sensor_y, self.heading)
+        final_x = np.rint(new_x + self.position.x).astype(int)
+        final_y = np.rint(new_y + self.position.y).astype(int)
+        self.sensor_positions = [point(x, y) for x, y in zip(final_x.tolist(), final_y.tolist())]
 
         return list(self.sensor_positions)
 
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single robot simulation, independent of pygame
+
+RobotCore holds the robot physics and state. display.Robot adds the pygame
+sprite on top of it, so headless runs never pay for drawing.
+"""
+
+import itertools
+
+import numpy as np
+
+import point
+from coordinates import Coordinates as coord
+import track_cache
+
+
+class RobotCore:
+    """Robot simulation state and rules, without any drawing
+
+      heading =      0 -> car aligned with  +X
+      heading =   pi/2 -> car aligned with  +Y
+      heading =     pi -> car aligned with  -X
+      heading = 3*pi/2 -> car aligned with  -Y
+
+    sensor IDs example with 8 sensors:
+     x x x x|x x x x
+     0 1 2 3 4 5 6 7
+    """
+    HEADING_PLUS_X = 0
+    HEADING_PLUS_Y = np.pi/2
+    HEADING_MINUS_X = np.pi
+    HEADING_MINUS_Y = 3*np.pi/2
+
+    OFF_TRACK = track_cache.OFF_TRACK
+
+    #point sensors read the track under each sensor, range sensors cast a ray
+    #from the robot towards each sensor and read the distance to the wall
+    SENSOR_POINTS = "points"
+    SENSOR_RANGE = "range"
+
+    id_iter = itertools.count()
+
+    def __init__(self, n_sensors, sensors_pitch=10, sensors_dist=100,
+                 init_point=None, pos=None, heading=HEADING_PLUS_X, sensor_headings=None):
+
+        #moving parameters
+        self.max_speed = 4
+        self.acc = 1
+        self.turn_rate = np.deg2rad(5)
+        
+        #print (init_point)
+
+        #initial conditions
+        if init_point is None:
+            init_point = point.Point(0,0)
+
+        self.speed = 0
+        self.alive = True
+        self.heading = heading
+        #the robot owns its points and moves them in place, never keep the caller's one
+        if(isinstance(pos, point.Point)):
+            self.pos = pos.copy()
+        else:
+            self.pos = init_point.copy()
+        self.last_position = self.pos.copy()
+        self.ray_point = point.Point(0, 0)
+        self.distance_to_finish = 0
+        self.last_distance_to_finish = 0
+        self.last_valid_distance = -1
+        self.steps_without_moving = 0
+        self.steps_without_improving = 0
+        self.steps_off_track = 0
+        self.steps_sensors_off_track = 0
+        self.best_distance = None
+        self.improved_this_step = False
+        self.last_sensor_reads = list()
+        self.steps_run = 0
+
+        #robot config parameters
+        self.n_sensors = n_sensors
+        self.sensors_dist = sensors_dist
+        self.sensors_pitch = sensors_pitch
+        
+        self.max_off_track = 6
+        self.max_without_moving = 80
+        self.max_without_improving = 80
+        self.max_sensors_off_track = 10
+
+        #track cells per full resolution pixel, lower than 1 on coarse track levels
+        self.track_scale = 1
+
+        self.sensor_mode = self.SENSOR_POINTS
+        self.max_range = sensors_dist * 2
+        self.heading_input = False
+        self.squash_controls = True
+
+        self.calculate_sensor_geometry(sensor_headings)
+        self.calculate_sensor_positions()
+        self.control_func = self.debug_control_func
+
+        self.id = next(self.id_iter)
+        self.update_count = 0
+        self.set_angle_rad(heading)
+    
+    def get_inputs_amount (self):
+        return len(self.get_inputs())
+        
+    def set_angle_deg(self, angle_deg):
+        self.set_angle_rad(np.deg2rad(np.remainder(angle_deg, 360)))
+
+    def set_angle_rad(self, angle_rad):
+        new_angle = np.remainder(angle_rad, 2*np.pi)
+        self.heading = new_angle
+
+    def set_pos(self, new_pos):
+        self.last_position.set_to(self.pos)
+        self.pos.set(new_pos.x, new_pos.y)
+
+    def set_path_read_func(self, path_read):
+        self.path_read_func = path_read
+        self.path_read_many_func = None
+
+    def debug_control_func(self, inputs):
+        for i in range(len(inputs)):
+            print("[{}]: {}".format(i, inputs[i]))
+        return [1, 0, 1, 0]
+
+    def set_control_func(self, control_func):
+        self.control_func = control_func
+
+    def set_control_unit(self, control_unit):
+        self.control_unit = control_unit
+
+    def set_path_distance_func(self, path_distance_read):
+        self.path_distance_func = path_distance_read
+
+    def set_track(self, track):
+        """Runs the robot over `track`, which may be a coarse level of a track pyramid.
+        Speeds and sensor offsets keep full resolution units and are scaled to the track"""
+        self.set_path_read_func(track.get_path)
+        self.path_read_many_func = track.get_path_many
+        self.set_path_distance_func(track.get_distance)
+        self.set_max_distance(track.max_distance)
+        self.track_scale = track.scale
+        self.wall_distance_func = getattr(track, "get_wall_distance", None)
+        self.direction_func = getattr(track, "get_direction", None)
+
+    def set_sensor_mode(self, mode, max_range=None):
+        """Selects SENSOR_POINTS or SENSOR_RANGE inputs. Range reads are the
+        distance to the wall along each sensor ray, divided by `max_range`"""
+        self.sensor_mode = mode
+        if max_range is not None:
+            self.max_range = max_range
+
+    def get_distance_to_finish(self):
+        return self.distance_to_finish
+
+    def get_last_distance_to_finish(self):
+        if self.alive:
+            return self.distance_to_finish
+        return self.last_distance_to_finish
+    
+    def get_last_valid_distance(self):
+        return self.last_valid_distance
+    
+    def set_max_distance(self, max_distance):
+        self.max_distance = max_distance
+
+    def get_fitness_distances(self):
+        last__valid_dist = self.get_last_valid_distance()
+        max_dist = self.max_distance
+        val = (max_dist - last__valid_dist)/max_dist
+        
+        return val
+    
+    def get_fitness_sensors(self):
+        val = (self.steps_run - self.steps_sensors_off_track) / self.steps_run
+        return val
+    
+    def get_fitness(self):
+        w_dist = 0.9
+        w_sensors = 0.1
+        w_sum = w_dist + w_sensors
+        return (w_dist * self.get_fitness_distances() + w_sensors*self.get_fitness_sensors())/w_sum
+        
+
+    def calculate_sensor_geometry(self, sensor_headings=None):
+        """Sensor layout in polar coordinates relative to the robot, it only changes
+        with the sensors setup. With `sensor_headings` the offsets are also tabled for
+        that many evenly spaced headings and the closest one is used at each step"""
+        # front sensors are numbered from left to right, with `sensors_pitch` distance between them
+        # they are positioned in a line perpendicular to track direction and `sensors_dist` apart from robot's position
+        sensor_x = self.sensors_dist
+        sensor_y = ((self.n_sensors - 1)/2 - np.arange(self.n_sensors)) * self.sensors_pitch
+        self.sensor_r, self.sensor_theta = coord.xy2polar(sensor_x, sensor_y)
+
+        self.sensor_headings = sensor_headings
+        if sensor_headings:
+            headings = np.arange(sensor_headings) * (2*np.pi / sensor_headings)
+            table_x, table_y = coord.polar2xy(self.sensor_r, self.sensor_theta + headings[:, None])
+            self.sensor_table = (table_x, -table_y)
+
+    def get_sensor_offsets(self):
+        """Sensor positions relative to the robot position, as x and y arrays"""
+        if self.sensor_headings:
+            k = int(round(self.heading * self.sensor_headings / (2*np.pi))) % self.sensor_headings
+            return self.sensor_table[0][k] * self.track_scale, self.sensor_table[1][k] * self.track_scale
+
+        #sum heading to theta to rotate every sensor at once
+        new_x, new_y = coord.polar2xy(self.sensor_r * self.track_scale, self.sensor_theta + self.heading)
+        return new_x, -new_y #inverted sign due to inverted Y axis direction
+
+    def get_sensor_xy(self):
+        """Sensor positions in reference to track's origin, as x and y arrays"""
+        offset_x, offset_y = self.get_sensor_offsets()
+        return self.pos.x + offset_x, self.pos.y + offset_y
+
+    def get_sensor_position(self, sensor_id):
+        sensors_x, sensors_y = self.get_sensor_xy()
+        return point.Point(sensors_x[sensor_id], sensors_y[sensor_id])
+
+    def calculate_sensor_positions(self):
+        sensors_x, sensors_y = self.get_sensor_xy()
+        if len(getattr(self, "sensor_positions", ())) != len(sensors_x):
+            self.sensor_positions = [point.Point(0, 0) for _ in range(len(sensors_x))]
+        for p, x, y in zip(self.sensor_positions, sensors_x.tolist(), sensors_y.tolist()):
+            p.set(x, y)
+
+        return list(self.sensor_positions)
+        
+        
+    def check_alive(self):
+        if self.path_read_func(self.pos) is None:
+            self.alive = False
+
+        if self.path_read_func(self.pos) == -1:
+            self.steps_off_track += 1
+            if (self.steps_off_track >= self.max_off_track):
+                self.alive = False
+        else:
+            self.steps_off_track = 0
+        
+        if self.improved_this_step is False:
+            self.steps_without_improving += 1
+            if self.steps_without_improving > self.max_without_improving:
+                self.alive = False
+        else:
+            self.steps_without_improving = 0
+        
+        if self.steps_without_moving >= self.max_without_moving:
+            self.alive = False
+        
+        return self.alive
+
+    def check_moved(self):
+        if self.alive and self.last_position != self.pos:
+            self.moved = True
+        else:
+            self.moved = False
+            self.steps_without_moving += 1
+        self.last_position.set_to(self.pos)
+        return self.moved
+    
+    def check_sensors_off_track(self):
+        if len(self.last_sensor_reads) > 0:
+            if len([i for i in self.last_sensor_reads if i >= 0]) == 0:
+                self.steps_sensors_off_track += 1
+
+    def calc_new_position(self):
+        x, y = coord.polar2xy(self.speed * self.track_scale, self.heading)
+        self.last_position.set_to(self.pos)
+        self.pos.iadd(x, -y)
+
+    def calc_new_distances(self):
+        if(self.alive):
+            self.last_distance_to_finish = self.distance_to_finish
+            self.distance_to_finish = self.path_distance_func(self.pos)
+        if (self.distance_to_finish >= 0):
+            self.last_valid_distance = self.distance_to_finish
+        #store best distance value achieved so far
+        if (self.best_distance is None):
+            self.best_distance = self.last_valid_distance
+        else:
+            if (self.last_valid_distance < self.best_distance):
+                self.best_distance = self.last_valid_distance
+                self.improved_this_step = True
+            else:
+                self.improved_this_step = False
+
+    def reset(self, start_point, start_heading_rad):
+        self.alive = True
+        self.set_pos(start_point)
+        self.set_angle_rad(start_heading_rad)
+        self.speed = 0
+        self.moved = False
+        self.steps_without_moving = 0
+        self.steps_without_improving = 0
+        self.steps_off_track = 0
+        self.best_distance = None
+        self.improved_this_step = False
+        self.last_sensor_reads = list()
+        self.steps_sensors_off_track = 0
+        self.steps_run = 0
+
+    def set_squash_controls(self, enabled):
+        """Controls are squashed with arctan(x)/(2*pi) before use. Disable it when
+        the control function already ends with the arctan activation"""
+        self.squash_controls = enabled
+
+    def set_heading_input(self, enabled):
+        """Adds the heading error against the track direction field as the last input"""
+        self.heading_input = enabled
+
+    def get_heading_error(self):
+        """Angle from the robot heading to the track direction under it, divided by pi.
+        Positive when the track turns left, 0 where the track has no direction"""
+        direction = self.direction_func(self.pos)
+        if np.isnan(direction):
+            return 0
+        return (np.remainder(direction - self.heading + np.pi, 2*np.pi) - np.pi) / np.pi
+
+    def cast_ray(self, sensor_id):
+        """Sphere traces the wall distance field from the robot towards a sensor.
+        Returns the distance to the wall divided by `max_range`, at most 1"""
+        dx, dy = coord.polar2xy(1, self.sensor_theta[sensor_id] + self.heading)
+        dy = -dy #inverted sign due to inverted Y axis direction
+
+        max_range = self.max_range * self.track_scale
+        dist = 0
+        while dist < max_range:
+            wall_dist = self.wall_distance_func(self.ray_point.set(self.pos.x + dist * dx, self.pos.y + dist * dy))
+            if wall_dist <= 0:
+                break
+            #moving less than wall_dist - 1 never lands in a cell closer than the wall
+            dist += max(wall_dist - 1, 1)
+        return min(dist, max_range) / max_range
+
+    def get_inputs(self):
+        inputs = list()
+        inputs.append(self.speed)
+        self.last_sensor_reads = list()
+        if self.sensor_mode == self.SENSOR_RANGE:
+            for i in range(self.n_sensors):
+                read = self.cast_ray(i)
+                inputs.append(read)
+                #a zero range means the sensor ray starts off track
+                self.last_sensor_reads.append(read if read > 0 else self.OFF_TRACK)
+        elif self.path_read_many_func is not None:
+            reads = list(self.path_read_many_func(*self.get_sensor_xy()))
+            inputs += reads
+            self.last_sensor_reads = reads
+        else:
+            for s in self.calculate_sensor_positions():
+                read = self.path_read_func(s)
+                inputs.append(read)
+                self.last_sensor_reads.append(read)
+
+        if self.heading_input:
+            inputs.append(self.get_heading_error())
+        return inputs
+
+    def update(self):
+        if self.alive is False:
+            return False
+        self.update_count += 1
+        self.steps_run += 1
+
+        acc, brake, left, right = self.control_func(self.get_inputs())
+        if self.squash_controls:
+            acc, brake, left, right = [np.arctan(c) / (np.pi * 2) for c in (acc, brake, left, right)]
+        self.check_sensors_off_track()
+        
+        if acc:
+#            speed_acc = self.acc * (np.arctan(acc) / (np.pi * 2))
+            speed_change = self.acc * acc
+            self.speed = min(self.speed + speed_change, self.max_speed)
+        if brake:
+#            speed_brake = self.acc * (np.arctan(brake) / (np.pi * 2))
+            speed_change = self.acc * brake
+            self.speed = max(self.speed - speed_change, (-1)*self.max_speed)
+        if left:
+#            angle_left = self.turn_rate * (np.arctan(left) / (np.pi * 2))
+            turn_angle = self.turn_rate * left
+            self.set_angle_rad(self.heading + turn_angle)
+        if right:
+#            angle_right = self.turn_rate * (np.arctan(right) / (np.pi * 2))
+            turn_angle = self.turn_rate * right
+            self.set_angle_rad(self.heading - turn_angle)
+
+        #limit heading to pi
+        self.calc_new_position()
+        self.check_alive()
+        self.check_moved()
+        if(self.alive is False):
+            self.set_pos(self.last_position)
+        self.calc_new_distances()
+        return True
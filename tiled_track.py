@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tiled track storage for maps too large to keep in memory
+
+The grids of a track compiled by track_cache are written tile by tile into
+raw files next to it, once per cache key and tile size:
+  <basename>.path.tiles       path grid, one tile_size x tile_size block after the other
+  <basename>.distances.tiles  distances grid, same layout
+  <basename>.walls.tiles      distances to the closest wall grid, same layout
+  <basename>.directions.tiles direction towards the end grid, same layout
+  <basename>.meta.npz         sizes, dtypes, start/end points and distances
+
+All tile files are memory mapped and a tile is only copied into memory when a
+robot reads from it. The most recently used tiles are kept in an LRU, so
+memory use is bounded by `max_tiles` and not by the map size.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import point
+import track_cache
+
+
+class TiledTrack:
+    OFF_TRACK = track_cache.OFF_TRACK
+    END_VALUE = track_cache.END_VALUE
+    OUT_OF_BOUNDS = track_cache.OUT_OF_BOUNDS
+
+    def __init__(self, basename, max_tiles=64):
+        with np.load(basename + ".meta.npz") as meta:
+            self.size_x = int(meta["size_x"])
+            self.size_y = int(meta["size_y"])
+            self.tile_size = int(meta["tile_size"])
+            path_dtype = np.dtype(str(meta["path_dtype"]))
+            distance_dtype = np.dtype(str(meta["distance_dtype"]))
+            direction_dtype = np.dtype(str(meta["direction_dtype"]))
+            start_point = meta["start_point"].tolist()
+            self.end_points = [point.Point(x, y) for x, y in meta["end_points"].tolist()]
+            self.max_distance = meta["max_distance"][()]
+            shortest = meta["shortest_distance"][()]
+            self.scale = float(meta["scale"])
+
+        self.start_point = point.Point(*start_point) if len(start_point) else None
+        self.shortest_distance = None if shortest == track_cache.NO_DISTANCE else shortest
+
+        self.tiles_x = -(-self.size_x // self.tile_size)
+        self.tiles_y = -(-self.size_y // self.tile_size)
+        shape = (self.tiles_y, self.tiles_x, self.tile_size, self.tile_size)
+        self.path_tiles = np.memmap(basename + ".path.tiles", dtype=path_dtype, mode="r", shape=shape)
+        self.distance_tiles = np.memmap(basename + ".distances.tiles", dtype=distance_dtype, mode="r", shape=shape)
+        self.wall_tiles = np.memmap(basename + ".walls.tiles", dtype=distance_dtype, mode="r", shape=shape)
+        self.direction_tiles = np.memmap(basename + ".directions.tiles", dtype=direction_dtype, mode="r", shape=shape)
+
+        self.max_tiles = max_tiles
+        self.hot_tiles = OrderedDict()
+        self.tiles_loaded = 0
+
+    @classmethod
+    def from_cache(cls, cache_dir, key, tile_size=256, max_tiles=64):
+        """Opens the tiles of the track cached under `key`, writing them from the
+        cached grids the first time. Later runs only open the tile files"""
+        basename = os.path.join(cache_dir, "{}.tiled{}".format(key, tile_size))
+        if not os.path.exists(basename + ".meta.npz"):
+            cls.write(basename, track_cache.load_track(cache_dir, key), tile_size)
+        return cls(basename, max_tiles=max_tiles)
+
+    @classmethod
+    def write(cls, basename, data, tile_size=256):
+        """Writes the grids of `data`, a dict as returned by track_cache.load_track,
+        as tiles. The memory mapped grids are copied one band of tiles at a time,
+        so they may be larger than the available memory"""
+        cls.write_tiles(data["path"], basename + ".path.tiles", tile_size)
+        cls.write_tiles(data["distances"], basename + ".distances.tiles", tile_size)
+        cls.write_tiles(data["wall_distances"], basename + ".walls.tiles", tile_size)
+        cls.write_tiles(data["directions"], basename + ".directions.tiles", tile_size)
+
+        size_y, size_x = data["path"].shape
+        start_point = np.array(data["start_point"] or [], dtype=np.int64)
+        end_points = np.array(data["end_points"], dtype=np.int64).reshape(-1, 2)
+        shortest = track_cache.NO_DISTANCE if data["shortest_distance"] is None else data["shortest_distance"]
+        #write metadata last, it marks the tiles as complete
+        np.savez(basename + ".meta.npz", size_x=size_x, size_y=size_y, tile_size=tile_size,
+                 path_dtype=str(data["path"].dtype), distance_dtype=str(data["distances"].dtype),
+                 direction_dtype=str(data["directions"].dtype),
+                 start_point=start_point, end_points=end_points, max_distance=data["max_distance"],
+                 shortest_distance=shortest, scale=data.get("scale", 1))
+
+    @classmethod
+    def write_tiles(cls, grid, filename, tile_size):
+        size_y, size_x = grid.shape
+        tiles_x = -(-size_x // tile_size)
+        tiles_y = -(-size_y // tile_size)
+        tiles = np.memmap(filename, dtype=grid.dtype, mode="w+", shape=(tiles_y, tiles_x, tile_size, tile_size))
+        for ty in range(tiles_y):
+            #cells past the grid borders are never read, fill them as off track
+            band = np.full((tile_size, tiles_x * tile_size), cls.OFF_TRACK, dtype=grid.dtype)
+            rows = grid[ty * tile_size:(ty + 1) * tile_size]
+            band[:len(rows), :size_x] = rows
+            tiles[ty] = band.reshape(tile_size, tiles_x, tile_size).swapaxes(0, 1)
+        tiles.flush()
+        del tiles
+
+    def get_tile (self, tile_x, tile_y):
+        """Returns the (path, distances, wall distances, directions) arrays of a tile,
+        loading it if needed"""
+        key = (tile_x, tile_y)
+        tile = self.hot_tiles.get(key)
+        if tile is None:
+            tile = (np.array(self.path_tiles[tile_y, tile_x]),
+                    np.array(self.distance_tiles[tile_y, tile_x]),
+                    np.array(self.wall_tiles[tile_y, tile_x]),
+                    np.array(self.direction_tiles[tile_y, tile_x]))
+            self.tiles_loaded += 1
+            self.hot_tiles[key] = tile
+            if len(self.hot_tiles) > self.max_tiles:
+                self.hot_tiles.popitem(last=False)
+        else:
+            self.hot_tiles.move_to_end(key)
+        return tile
+
+    def read (self, grid_index, point):
+        x = point.int_x()
+        y = point.int_y()
+        tile = self.get_tile(x // self.tile_size, y // self.tile_size)[grid_index]
+        return tile[y % self.tile_size][x % self.tile_size]
+
+    def get_path (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return self.OFF_TRACK
+        return self.read(0, point)
+
+    def get_distance (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return None
+        return self.read(1, point)
+
+    def get_wall_distance (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return 0
+        return self.read(2, point)
+
+    def get_direction (self, point):
+        if point.x >= self.size_x or point.y >= self.size_y or \
+            point.x < 0 or point.y < 0:
+            return np.nan
+        return self.read(3, point)
+
+    def get_path_many (self, xs, ys):
+        """get_path for arrays of coordinates, OFF_TRACK outside the track"""
+        return self.read_many(0, self.path_tiles.dtype, xs, ys, self.OFF_TRACK)
+
+    def get_distance_many (self, xs, ys):
+        """get_distance for arrays of coordinates, OUT_OF_BOUNDS outside the track"""
+        return self.read_many(1, self.distance_tiles.dtype, xs, ys, self.OUT_OF_BOUNDS)
+
+    def get_wall_distance_many (self, xs, ys):
+        """get_wall_distance for arrays of coordinates, 0 outside the track"""
+        return self.read_many(2, self.wall_tiles.dtype, xs, ys, 0)
+
+    def get_direction_many (self, xs, ys):
+        """get_direction for arrays of coordinates, NaN outside the track"""
+        return self.read_many(3, self.direction_tiles.dtype, xs, ys, np.nan)
+
+    def read_many (self, grid_index, dtype, xs, ys, outside_value):
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        int_x = np.rint(xs)
+        int_y = np.rint(ys)
+        inside = (xs >= 0) & (ys >= 0) & (int_x < self.size_x) & (int_y < self.size_y)
+
+        x = int_x[inside].astype(np.intp)
+        y = int_y[inside].astype(np.intp)
+        tile_ids = (y // self.tile_size) * self.tiles_x + x // self.tile_size
+        read = np.empty(len(x), dtype=dtype)
+        for tile_id in np.unique(tile_ids).tolist():
+            in_tile = tile_ids == tile_id
+            tile_y, tile_x = divmod(tile_id, self.tiles_x)
+            tile = self.get_tile(tile_x, tile_y)[grid_index]
+            read[in_tile] = tile[y[in_tile] % self.tile_size, x[in_tile] % self.tile_size]
+
+        values = np.full(xs.shape, outside_value, dtype=dtype)
+        values[inside] = read
+        return values
@@ -26,20 +26,6 @@ def put_square_over_image (x, y, size, color,win):
     pygame.draw.rect(win, color, (x,y, size, size))
     pygame.display.update()
 
-def polar2z(r,theta):
-    return r * np.exp( 1j * theta )
-
-def z2polar(z):
-    return ( abs(z), np.angle(z) )
-
-def xy2polar(x,y):
-    return z2polar(x + y * 1j)
-
-def z2xy(z):
-    return (np.real(z), np.imag(z))
-
-def polar2xy(r,theta):
-    return z2xy(polar2z(r,theta))
 
 
 
@@ -71,7 +57,7 @@ class track:
     def calc_distances (self, print_steps=False):
         print("\nStarting to calculate distances")
         finished = False
-        self.distances = np.array(self.path)
+        self.distances = np.array(self.path, dtype=np.int32)
         for cell in np.nditer(self.distances, op_flags=['readwrite']):
             if cell == self.ON_TRACK:
                 cell[...] = self.EMPTY_DISTANCE
@@ -158,27 +144,25 @@ class track:
         self.size_x = track_image.size[0]
         self.size_y = track_image.size[1]
         self.image = track_image.copy()
-        self.path = np.ones((self.size_y, self.size_x)) * self.OFF_TRACK
-
-        for x in range(self.size_x):
-            for y in range(self.size_y):
-                p = point (x,y)
-                pix = self.image.getpixel((x,self.size_y - 1 - y))
-                if pix == self.START_COLOR:
-                    if self.start_point == None:
-                        self.start_point = p
-                    self.set_path(p, self.ON_TRACK)
-                    continue
-                if pix == self.END_COLOR:
-                    self.set_path(p, self.END_VALUE)
-                    self.end_points.append(p)
-                    continue
-                if pix == self.ON_TRACK_COLOR:
-                    self.set_path(p, self.ON_TRACK)
-                    continue
-                if pix == self.OFF_TRACK_COLOR:
-                    self.set_path(p, self.OFF_TRACK)
-                    continue
+        self.path = np.full((self.size_y, self.size_x), self.OFF_TRACK, dtype=np.int8)
+
+        #classify every pixel at once, rows are flipped so Y grows upwards
+        pixels = np.asarray(self.image.convert("RGB"))[::-1]
+        start_mask = np.all(pixels == self.START_COLOR, axis=-1)
+        end_mask = np.all(pixels == self.END_COLOR, axis=-1)
+        on_track_mask = np.all(pixels == self.ON_TRACK_COLOR, axis=-1)
+
+        self.path[on_track_mask | start_mask] = self.ON_TRACK
+        self.path[end_mask] = self.END_VALUE
+
+        #points are listed scanning X first and then Y, as the pixel walk did
+        if self.start_point == None:
+            start_x, start_y = np.nonzero(start_mask.T)
+            if len(start_x) > 0:
+                self.start_point = point(int(start_x[0]), int(start_y[0]))
+        end_x, end_y = np.nonzero(end_mask.T)
+        for x, y in zip(end_x.tolist(), end_y.tolist()):
+            self.end_points.append(point(x, y))
 
         #print (self.path)
         self.calc_distances()
@@ -189,15 +173,13 @@ class track:
             print ("max distance:", self.max_distance)
             print ("min distance:", self.shortest_distance)
             color_gain = (255 - 40) / self.max_distance
-            self.win.fill((0,0,0))
-            for x in range(self.size_x):
-                for y in range(self.size_y):
-                    p = point(x,y)
-                    dist = self.get_distance(p)
-                    if (dist > 0):
-                        R = (int(dist * color_gain) + 40)
-                        color = (R,40,40)
-                        pygame.draw.rect(self.win,color,(x,self.size_y - 1 - y,1,1))
+            #rows are flipped back so Y grows upwards on screen
+            dist = self.distances[::-1]
+            pixels = np.zeros((self.size_y, self.size_x, 3), dtype=np.uint8)
+            calculated = dist > 0
+            pixels[calculated] = (40, 40, 40)
+            pixels[calculated, 0] = (dist[calculated] * color_gain).astype(np.uint8) + 40
+            self.win.blit(pygame.surfarray.make_surface(pixels.swapaxes(0, 1)), (0, 0))
             self.distances_plot = pygame.Surface.copy(self.win)
         else:
             self.win.blit(self.distances_plot,(0,0))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of compiled tracks
+
+A compiled track is stored as five files sharing the same key:
+  <key>.path.npy       path classification grid
+  <key>.distances.npy  distances to finish grid
+  <key>.walls.npy      distances to the closest wall grid
+  <key>.directions.npy direction towards the end grid
+  <key>.meta.npz       start point, end points, max and shortest distances
+
+The key is a hash of the source image file bytes and the resize size, so
+the image does not need to be decoded to find out if it was cached.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+#change it every time the stored arrays layout changes
+CACHE_VERSION = 5
+
+#stored in place of shortest_distance when it is None
+NO_DISTANCE = -1
+
+#values of the cached grids shared by every track reader
+#path grid cells outside of the track
+OFF_TRACK = -1
+#distances grid value on the end points
+END_VALUE = 0
+#batched distance reads return it outside of the grid, where get_distance returns None
+OUT_OF_BOUNDS = -3
+
+
+def cache_key(filename, size=None):
+    h = hashlib.sha1()
+    h.update("v{} size:{}".format(CACHE_VERSION, size).encode())
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_files(cache_dir, key):
+    base = os.path.join(cache_dir, key)
+    return (base + ".path.npy", base + ".distances.npy", base + ".walls.npy",
+            base + ".directions.npy", base + ".meta.npz")
+
+
+def is_cached(cache_dir, key):
+    return all(os.path.exists(f) for f in cache_files(cache_dir, key))
+
+
+def save_track(track, cache_dir, key):
+    os.makedirs(cache_dir, exist_ok=True)
+    path_file, distances_file, walls_file, directions_file, meta_file = cache_files(cache_dir, key)
+
+    if track.start_point is None:
+        start_point = np.array([], dtype=np.int64)
+    else:
+        start_point = np.array(track.start_point.get_int_xy(), dtype=np.int64)
+    end_points = np.array([p.get_int_xy() for p in track.end_points], dtype=np.int64).reshape(-1, 2)
+    shortest = NO_DISTANCE if track.shortest_distance is None else track.shortest_distance
+
+    np.save(path_file, track.path)
+    np.save(distances_file, track.distances)
+    np.save(walls_file, track.wall_distances)
+    np.save(directions_file, track.directions)
+    #write metadata last, it marks the entry as complete
+    np.savez(meta_file, start_point=start_point, end_points=end_points,
+             max_distance=track.max_distance, shortest_distance=shortest)
+
+
+def load_track(cache_dir, key):
+    """Returns a dict with the cached arrays and metadata.
+    The grids are memory mapped copy-on-write, pages are only read when used"""
+    path_file, distances_file, walls_file, directions_file, meta_file = cache_files(cache_dir, key)
+
+    with np.load(meta_file) as meta:
+        start_point = meta["start_point"]
+        shortest = meta["shortest_distance"][()]
+        data = {
+            "path": np.load(path_file, mmap_mode="c"),
+            "distances": np.load(distances_file, mmap_mode="c"),
+            "wall_distances": np.load(walls_file, mmap_mode="c"),
+            "directions": np.load(directions_file, mmap_mode="c"),
+            "start_point": tuple(start_point.tolist()) if len(start_point) else None,
+            "end_points": [tuple(p) for p in meta["end_points"].tolist()],
+            "max_distance": meta["max_distance"][()],
+            "shortest_distance": None if shortest == NO_DISTANCE else shortest,
+        }
+    return data